@@ -37,6 +37,12 @@ txtInput = DataPath + sDate[0:4] + os.sep + sDate + '-*'
 ending = 'txt'  # file ending (any string)
 sep    = '\t'   # separator used in file (string, i.e. '\t', ',', ';', ...)  
 skip   = 1      # number of header rows in ascii input files to skip
+chunk  = 200000 # number of rows read at once from ascii input files
+                # (SWITCH_INPUT 'stream' only)
+
+# details on netcdf output files (SWITCH_NCAPPEND only)
+NCchunk     = 256   # number of time steps per chunk
+NCcomplevel = 4     # zlib compression level (1 to 9)
 
 
 # OUTPUT PATH for figures and files
@@ -45,6 +51,8 @@ OutPath = "C:\\Users\\JANA\\Documents\\NUIG-work\\DATA\\NUIGdata\\WindCube\\2016
 # RELATIVE OUTPUT PATH
 ncOUT = OutPath + sDate[0:4] + os.sep
 figOUT = ncOUT
+# catalog of netcdf products of all days (SWITCH_CATALOG only)
+CatalogFile = OutPath + 'windcube_catalog.csv'
 
 
 # =============================================================================
@@ -72,7 +80,37 @@ SWITCH_INPUT     = 'text'   # uses existing netcdf files if in data path
                             # data path and removes this text file ('append', 
                             # also faulty!), or stores data in temporary
                             # pickle files and appends latest text file
-                            # ('pickle', recommended and fastest)
+                            # ('pickle', recommended and fastest), or reads
+                            # text files scan by scan and processes each scan
+                            # at once, keeping only one scan in memory
+                            # ('stream', for computers with little memory),
+                            # or reads only
+                            # lines added to the text files since the last
+                            # run and updates the products of the day
+                            # ('incremental', for frequent near real time runs),
+                            # or appends text files to a memory-mapped day 
+                            # store (one file per column) and removes them 
+                            # ('store', replaces 'pickle'; spectra are read
+                            # from the text files as with 'text')
+SWITCH_NCREAD    = 'netcdf4'  # reads existing netcdf files (SWITCH_INPUT
+                            # 'netcdf' and 'append') with netCDF4 straight to
+                            # numpy arrays ('netcdf4', fast), or with xray
+                            # ('xray')
+SWITCH_FASTREAD  = True     # reads text files with the C parser, vectorized
+                            # time stamp parsing and the data types given in
+                            # VarDict (True), or with the python parser and
+                            # a time stamp parser per row (False, slow)
+SWITCH_COMPACT   = True     # keeps text file data in memory with compact
+                            # data types (float32 measurements, int16 IDs, 
+                            # int8 status) (True), or float64/int64 (False)
+SWITCH_NCAPPEND  = True     # writes zlib compressed netcdf4 files with an
+                            # unlimited time dimension and appends new scans
+                            # to existing files in place (True), or rewrites
+                            # all netcdf files (False)
+SWITCH_CATALOG   = True     # keeps catalog of all netcdf products (file,
+                            # variable, scan ID, time and range span,
+                            # elevation) in CatalogFile, updated whenever a
+                            # file is written (True)
 SWITCH_OUTPUT    = True     # prints status messages on screen if run from 
                             # command line (True)
 SWITCH_TIMER     = True     # times the main processes while running the 
@@ -84,6 +122,31 @@ SWITCH_HDCP2     = False    # prepares two output files in HDCP2 format
 SWITCH_POOL      = 0        # integer of number of parallel processing pools
                             # to use to read input and fit VAD (0 for no 
                             # parallel processing)
+SWITCH_EXPORTPOOL = 0       # integer of number of parallel processes writing
+                            # the netcdf files of different scan IDs (0 for
+                            # no parallel processing)
+SWITCH_PLOTPOOL  = 0        # integer of number of parallel processes 
+                            # rendering the plots while processing goes on
+                            # (0 for plotting in the main process)
+SWITCH_PLOTCACHE = True     # skips gridding and plotting if the input data
+                            # and plot settings are unchanged since the
+                            # existing image was saved
+                            # (md5 key in file next to the image) (True)
+SWITCH_TSRASTER  = True     # keeps 1 minute raster of the vertical line of
+                            # sight of the day in a file, bins only new data
+                            # and draws time series plot from it (True)
+SWITCH_POLAR     = 'mesh'   # draws low level scans with pcolormesh on a mesh
+                            # kept for each scan geometry ('mesh', fast), or
+                            # as filled contours ('contour')
+SWITCH_FIT       = 'linear' # fits VAD of all range gates and scans at once
+                            # by linear least squares ('linear', fast), or
+                            # fits each range gate with scipy leastsq
+                            # ('leastsq', reference)
+SWITCH_VADCACHE  = True     # keeps fitted VAD scans of the day in a cache
+                            # file and fits only new or changed scans (True)
+SWITCH_OUTLIER   = False    # removes outliers of radial wind of each scan
+                            # and range gate before the VAD fit (median 
+                            # absolute deviation test, OutlierMargin) (True)
 SWITCH_MODE      = ['VAD']    # calculates/plots only certain scan 
                                       # types ('VAD', 'LOW', 'LOS', 'LOS90'), 
                                       # or all scan types ('all')
@@ -125,6 +188,20 @@ LowerAngle = 15
 UpperAngle = 75
 CombiAlt = 150
 
+# maximum time between VAD scan and DBS profile compared to it (minutes)
+DBSmaxage = 15
+
+# outliers removed before VAD fit (SWITCH_OUTLIER): deviation from median of 
+# scan and range gate larger than OutlierMargin times the median deviation
+OutlierMargin = 40
+# number of iteratively reweighted fits (Tukey biweight) after the first fit
+# of the linear VAD fit (SWITCH_FIT 'linear'), 0 for ordinary least squares
+FitIter = 0
+
+# time gap between scans (seconds); a new scan starts after a longer gap 
+# without data or where the (composite) scan ID changes
+ScanGap = 59
+
 # =============================================================================
 ### OUTPUT SPECIFICATIONS ###
 
@@ -1,5 +1,6 @@
 import datetime as dt
 import os
+import shutil
 import pandas as pd
 from glob import glob
 import pdb
@@ -33,12 +34,25 @@ def main(sDate,p):
     InPKL = sorted(glob(cl.ncInput + fend + '.pkl'))
     InTXT = sorted(glob(cl.txtInput + cl.VarDict[p]['fend'] + '.' + cl.ending))
 
+    # process text files scan by scan
+    if cl.SWITCH_INPUT=='stream' or cl.SWITCH_INPUT=='incremental':
+        if not InTXT:
+            wio.printif( '... no new text file' )
+        elif cl.SWITCH_INPUT=='stream':
+            main_stream(sDate, p, wio.iter_scans(InTXT, p))
+        else:
+            main_incremental(sDate, p, InTXT)
+        return
+
     # read input depending on settings in config file
     if InNC and (cl.SWITCH_INPUT=='append' or cl.SWITCH_INPUT=='netcdf'):
         # 1) read netcdf files in list
         wio.printif('... netcdf file found')
-        AllF = pd.concat([AllF.append(wio.open_existing_nc(ncf)) \
-                for ncf in InNC])
+        if cl.SWITCH_NCREAD=='netcdf4':
+            ncreader = wio.open_with_netcdf4
+        else:
+            ncreader = wio.open_existing_nc
+        AllF = pd.concat([AllF.append(ncreader(ncf)) for ncf in InNC])
         # rename variables for consistent input
         if 'dv' in AllF:
             AllF.rename(columns={'dv':'radial_wind_speed'}, inplace=True)
@@ -51,8 +65,10 @@ def main(sDate,p):
             AllF = AllF.sort_index()
             os.remove(InTXT[-1])
         AllF.drop_duplicates(inplace=True)
-    # 3) open pickle file
-    elif (cl.SWITCH_INPUT=='text' or cl.SWITCH_INPUT=='pickle'):
+    # 3) open pickle file (spectra are read from text files also if 
+    # SWITCH_INPUT is 'store', their strings are not kept in the day store)
+    elif (cl.SWITCH_INPUT=='text' or cl.SWITCH_INPUT=='pickle') \
+            or (cl.SWITCH_INPUT=='store' and p=='spectra'):
         if InPKL and cl.SWITCH_INPUT=='pickle':
             wio.printif('... open pickle')
             AllF = pd.read_pickle(InPKL[0])
@@ -88,16 +104,42 @@ def main(sDate,p):
             wio.printif( '... no new text file' )
         else:
             wio.printif( '... Please check SWITCH_POOL in config file!' )
+    # 5) append text files to columnar day store and open it
+    elif cl.SWITCH_INPUT=='store':
+        storepath = cl.ncInput + fend + '_store' + os.sep
+        for f in InTXT:
+            wio.printif('... adding file to store ' + f)
+            wio.store_append(storepath, wio.get_data(f,p))
+            os.remove(f)
+        # read only columns of the product (exported to netcdf), or only 
+        # columns needed for plots and fit if no netcdf is written
+        if cl.SWITCH_OUTNC:
+            cols = list( cl.VarDict[p]['cols'] )
+        else:
+            cols = [ cl.VarDict[pp]['cols'][cl.VarDict[pp]['N']] \
+                    for pp in [p, 'cnr'] ] \
+                    + ['ele', 'azi', 'scan_ID', 'confidence_index']
+        # read only rows of the processed day
+        dtDay = dt.datetime.strptime(sDate, '%Y%m%d')
+        tlim = [ dtDay, dtDay + dt.timedelta(days=1) ]
+        wio.printif('... open store')
+        AllF = wio.store_open(storepath, cols, tlim)
         
     INPUTTIME = wt.timer(STARTTIME)
 
     # change scan IDs of LOS to composite VAD
     AllF = wt.change_scan_IDs(AllF)
+    # index of all scans (row positions), scans are taken from it by fit, 
+    # plots and export
+    six = wt.scan_index(AllF)
+    # keep level 1 data in memory for HDCP2 output
+    if cl.SWITCH_HDCP2 and p in ['wind', 'beta']:
+        wio.keep_product(sDate, fend, AllF)
 
     # export content of data frame to netcdf
     if cl.SWITCH_OUTNC:
         wio.printif('... export nc')
-        wio.export_to_netcdf(AllF,p,sDate,'')
+        wio.export_to_netcdf(AllF,p,sDate,'',six=six)
         EXPORTTIME = wt.timer(STARTTIME)
     # export content of data frame to pickle file
     if cl.SWITCH_INPUT=='pickle':
@@ -113,18 +155,24 @@ def main(sDate,p):
         if oldpkl:
             wio.printif('... remove old pickle')
             [os.remove(f) for f in oldpkl]
+    # remove yesterday's store
+    if cl.SWITCH_INPUT=='store':
+        dtDate = dt.datetime.strptime( sDate, '%Y%m%d' ) - dt.timedelta(days=1)
+        yesteryear = dt.datetime.strftime( dtDate, '%Y')
+        yesterday = dt.datetime.strftime( dtDate, '%Y%m%d')
+        oldstore = os.path.split( os.path.split(cl.ncInput)[0] )[0] \
+                + os.sep + yesteryear + os.sep + yesterday + '_' + fend + '_store'
+        if os.path.isdir(oldstore):
+            wio.printif('... remove old store')
+            shutil.rmtree(oldstore)
 
     # plot time series (vertical line-of-sight only, 24h)
     if p<>'spectra':
         if ('LOS90' in cl.SWITCH_MODE or 'all' in cl.SWITCH_MODE) \
                 and cl.SWITCH_PLOT:
+            # (plot modes are compared in windcube_benchmark.bench_plot_ts)
             if p=='wind':
-                print('time series plot speed test')
-                TSTIME1 = wt.timer(STARTTIME)
                 wp.plot_ts(AllF,'cnr',sDate,['dummy'])
-                TSTIME2 = wt.timer(TSTIME1)
-                wp.plot_ts(AllF,'cnr',sDate,['dummy','fast'])
-                TSTIME3 = wt.timer(TSTIME2)
             wp.plot_ts(AllF,p,sDate,['dummy'])
             TSTIME = wt.timer(STARTTIME)
     
@@ -132,34 +180,36 @@ def main(sDate,p):
             # plot low level scans (polar)
             if ('LOW' in cl.SWITCH_MODE or 'all' in cl.SWITCH_MODE) \
                     and cl.SWITCH_PLOT:
-                [wp.plot_low_scan( AllF[AllF.scan_ID==LOWscan], p, sDate ) \
-                        for LOWscan in cl.ScanID['LOW']]
-                if p=='wind':
-                    [wp.plot_low_scan( AllF[AllF.scan_ID==LOWscan], 'cnr', sDate ) \
-                            for LOWscan in cl.ScanID['LOW']]
+                for LOWscan in cl.ScanID['LOW']:
+                    low, starts, stops = wt.scan_rows(AllF, six, LOWscan)
+                    wp.plot_low_scan( low, p, sDate, starts, stops )
+                    if p=='wind':
+                        wp.plot_low_scan( low, 'cnr', sDate, starts, stops )
                 LOWTIME = wt.timer(STARTTIME)
 
             # plot line-of-sight scans (scan duration)
             if ('LOS' in cl.SWITCH_MODE or 'all' in cl.SWITCH_MODE) \
                     and cl.SWITCH_PLOT:
-                [wp.plot_los( AllF[AllF.scan_ID==LOSscan], p, sDate ) \
-                        for LOSscan in cl.ScanID['LOS']]
-                if p=='wind':
-                    [wp.plot_los( AllF[AllF.scan_ID==LOSscan], 'cnr', sDate ) \
-                            for LOSscan in cl.ScanID['LOS']]
+                for LOSscan in cl.ScanID['LOS']:
+                    los = wt.scan_rows(AllF, six, LOSscan)[0]
+                    wp.plot_los( los, p, sDate )
+                    if p=='wind':
+                        wp.plot_los( los, 'cnr', sDate )
                 LOSTIME = wt.timer(STARTTIME)
 
             # calculate horizontal wind speed and direction
             if 'VAD' in cl.SWITCH_MODE or 'all' in cl.SWITCH_MODE:
                 if p=='wind':
                     wio.printif('... fitting radial wind')
-                    wt.wind_fit(AllF, p, sDate)
+                    wt.wind_fit(AllF, p, sDate, six)
 
         if p=='dbs':
             # compare DBS wind components to VAD scan results 
             # (75 degrees elevation VAD scan only)
             we.compare_dbs(AllF, p, sDate)
 
+    # wait for plots still rendered in pool of plot processes
+    wp.wait_plots()
     ENDTIME = wt.timer(STARTTIME)
 
     # create hdcp2-type output files if specified in config file 
@@ -169,6 +219,157 @@ def main(sDate,p):
 
 
 
+# processes scans one by one (SWITCH_INPUT 'stream' and 'incremental'); 
+# only one scan and the reduced data needed for the daily products (prod) 
+# are kept in memory; returns the updated products
+def main_stream(sDate, p, scans, prod=None):
+    STARTTIME = time.time()
+    isall = 'all' in cl.SWITCH_MODE
+    plotlist = [p]
+    if p=='wind':
+        plotlist.append('cnr')
+    # columns kept of line-of-sight scans for plotting
+    keep = [ cl.VarDict[pp]['cols'][cl.VarDict[pp]['N']] for pp in plotlist ] \
+            + ['ele', 'azi', 'scan_ID', 'confidence_index']
+    if prod is None:
+        prod = {
+                'TS'     : [],  # 1 minute averages of vertical line-of-sight
+                                # (raw rows of this run with SWITCH_TSRASTER)
+                'LOS'    : {},  # line-of-sight scans, per scan ID
+                'VAD'    : {},  # fitted VAD scans, per scan ID
+                'VADele' : {},  # elevation of VAD scans, per scan ID
+                'LOWn'   : {},  # position of low level scans in data of day
+                'DBS'    : [],
+                }
+    nscans = 0
+
+    for scan in scans:
+        nscans = nscans + 1
+        # change scan IDs of LOS to composite VAD
+        if 'scan_ID' in scan:
+            scan = wt.change_scan_IDs(scan)
+            sID = scan['scan_ID'].iloc[0]
+        else:
+            sID = None
+
+        # export scan to netcdf, append to file of scan ID or one file per 
+        # scan
+        if cl.SWITCH_OUTNC and p<>'dbs':
+            if cl.SWITCH_NCAPPEND:
+                scanadd = ''
+            else:
+                scanadd = '_' + scan.index[0][0].strftime('%H%M%S')
+            wio.export_to_netcdf(scan.copy(), p, sDate, '', scanadd)
+
+        if p=='spectra':
+            continue
+        elif p=='dbs':
+            prod['DBS'].append(scan)
+            continue
+
+        cols = [ c for c in keep if c in scan ]
+        # reduce vertical line-of-sight to 1 minute for time series plot;
+        # with SWITCH_TSRASTER the raw rows are binned into the raster of the 
+        # day, at least every cl.chunk rows
+        if ('LOS90' in cl.SWITCH_MODE or isall) and cl.SWITCH_PLOT:
+            vert = scan.loc[scan.ele>=89.5, cols]
+            if len(vert)>0 and cl.SWITCH_TSRASTER:
+                prod['TS'].append(vert)
+                if sum([ len(v) for v in prod['TS'] ]) > cl.chunk:
+                    vert = pd.concat(prod['TS'])
+                    for pp in plotlist:
+                        wp.update_raster_day(vert, pp, sDate)
+                    # last rows kept for the plot of the raster
+                    prod['TS'] = [ vert.iloc[-1:] ]
+            elif len(vert)>0:
+                prod['TS'].append( wt.grid_data(vert, '1T') )
+
+        # plot low level scans (polar)
+        if ('LOW' in cl.SWITCH_MODE or isall) and cl.SWITCH_PLOT \
+                and sID in cl.ScanID['LOW']:
+            n = prod['LOWn'].get(sID, 0)
+            for pp in plotlist:
+                wp.plot_polar(scan, pp, sDate, n)
+            prod['LOWn'][sID] = n + len(scan)
+
+        # keep line-of-sight scans
+        if ('LOS' in cl.SWITCH_MODE or isall) and cl.SWITCH_PLOT \
+                and sID in cl.ScanID['LOS']:
+            prod['LOS'].setdefault(sID, []).append( scan[cols] )
+
+        # fit VAD scan
+        if ('VAD' in cl.SWITCH_MODE or isall) and p=='wind' \
+                and sID in cl.ScanID['VAD']:
+            wio.printif('.... fitting VAD ' + str(sID) )
+            prod['VAD'].setdefault(sID, []).append( wt.fit_stream_scan(scan, p) )
+            prod['VADele'][sID] = scan['ele'][0]
+
+    INPUTTIME = wt.timer(STARTTIME)
+    if nscans==0:
+        wio.printif( '... no new scan' )
+        return prod
+
+    # join the reduced data of all scans
+    if prod['TS'] and cl.SWITCH_TSRASTER:
+        prod['TS'] = [ pd.concat(prod['TS']) ]
+    elif prod['TS']:
+        prod['TS'] = [ pd.concat(prod['TS']).groupby(level=['time','range']).mean() ]
+    for key in ['LOS', 'VAD']:
+        for sID in prod[key]:
+            prod[key][sID] = [ pd.concat(prod[key][sID]) ]
+    if prod['DBS']:
+        prod['DBS'] = [ pd.concat(prod['DBS']) ]
+
+    # plot time series (vertical line-of-sight only, 24h)
+    if prod['TS']:
+        for pp in plotlist:
+            wp.plot_ts(prod['TS'][0].copy(), pp, sDate, ['dummy'])
+        # raw rows are in the raster file, not kept for the next run
+        if cl.SWITCH_TSRASTER:
+            prod['TS'] = []
+    # plot line-of-sight scans (scan duration)
+    for LOSscan in prod['LOS']:
+        for pp in plotlist:
+            wp.plot_los(prod['LOS'][LOSscan][0], pp, sDate)
+    # VAD output per scan ID and combined VAD
+    if prod['VAD']:
+        combodf = pd.concat([ wt.vad_output(prod['VAD'][VADscan][0].copy(), 
+            prod['VADele'][VADscan], p, sDate) for VADscan in prod['VAD'] ])
+        wt.combine_vad(combodf, p, sDate)
+    # compare DBS wind components to VAD scan results
+    if prod['DBS']:
+        we.compare_dbs(prod['DBS'][0].copy(), p, sDate)
+
+    # wait for plots still rendered in pool of plot processes
+    wp.wait_plots()
+    ENDTIME = wt.timer(STARTTIME)
+
+    if (cl.SWITCH_PLOT or cl.SWITCH_OUTNC) and cl.SWITCH_HDCP2:
+        we.create_hdcp2_output(cl.sDate)
+
+    return prod
+
+
+# processes only lines added to the text files since the last run 
+# (SWITCH_INPUT 'incremental'); byte offsets and time of last row per file 
+# are kept in a state file, the reduced daily products in a pickle file
+def main_incremental(sDate, p, InTXT):
+    fend = cl.VarDict[p]['cols'][cl.VarDict[p]['N']]
+    statefile = cl.ncInput + fend + '_ingest.json'
+    prodfile = cl.ncInput + fend + '_ingest.pkl'
+    state = wio.read_state(statefile)
+    if os.path.exists(prodfile):
+        wio.printif('... open products of previous run')
+        prod = pd.read_pickle(prodfile)
+    else:
+        prod = None
+    prod = main_stream(sDate, p, wio.iter_new_scans(InTXT, p, state), prod)
+    # the state is updated while reading, save it after all scans are done
+    wio.write_state(statefile, state)
+    pd.to_pickle(prod, prodfile)
+
+
+
 if __name__=="__main__":
     # creating output path if not existing
     if os.path.exists(cl.OutPath):
@@ -185,4 +386,8 @@ if __name__=="__main__":
         else:
             print( '.. no output selected. Abort execution! \
                     Please adjust run options in config_lidar.py.' )
+    # close pool of VAD fit (kept open for all calls of wind_fit)
+    wt.close_pool()
+    # wait for remaining plots and close pool of plot processes
+    wp.close_plot_pool()
 
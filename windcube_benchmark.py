@@ -0,0 +1,460 @@
+# speed tests of the windcube processing steps on the data of sDate
+# (uses the input paths and settings in config_lidar.py)
+#
+# run from command line: python windcube_benchmark.py
+# (python windcube_benchmark.py check runs only the checks on synthetic data)
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from glob import glob
+
+import numpy as np
+import pandas as pd
+
+# contains windcube constants and custom settings
+import config_lidar as cl
+import windcube_io as wio
+import windcube_tools as wt
+import windcube_extras as we
+import windcube_plotting as wp
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+
+# times function call, returns result and time elapsed in seconds
+def timeit(func, *args):
+    t0 = time.time()
+    res = func(*args)
+    return res, time.time() - t0
+
+
+# prints number of rows per second for each of the timed readers
+def print_rate(label, nrows, sec):
+    print( '%-24s %12d rows %10.2f s %14.0f rows/s' \
+            % (label, nrows, sec, nrows / max(sec, 1e-9)) )
+
+
+# compares python reader and C reader of text files, checks identical output
+def bench_get_data(InTXT, sProp):
+    print( '.. reading ' + str(len(InTXT)) + ' ' + sProp + ' text files' )
+    tpy = 0.0
+    tc = 0.0
+    nrows = 0
+    for f in InTXT:
+        pydf, sec = timeit( wio.read_text, f, sProp )
+        tpy = tpy + sec
+        cdf, sec = timeit( wio.read_text_fast, f, sProp )
+        tc = tc + sec
+        nrows = nrows + len(pydf)
+        pd.util.testing.assert_frame_equal( wio.prepare_data(pydf),
+                wio.prepare_data(cdf) )
+    print_rate( 'python parser', nrows, tpy )
+    print_rate( 'C parser (fast read)', nrows, tc )
+
+
+# compares spectra decoding with split/stack/unstack and vectorized decoding
+def bench_spectra(InTXT):
+    print( '.. decoding spectra of ' + str(len(InTXT)) + ' text files' )
+    tref = 0.0
+    tvec = 0.0
+    nrows = 0
+    for f in InTXT:
+        df = wio.get_data(f, 'spectra')
+        for s in df.scan_ID.unique():
+            dfsID = df[df['scan_ID']==s]
+            (fbref, valref), sec = timeit( wio.decode_spectra_unstack, dfsID )
+            tref = tref + sec
+            (fbvec, valvec), sec = timeit( wio.decode_spectra, dfsID )
+            tvec = tvec + sec
+            nrows = nrows + len(dfsID)
+            np.testing.assert_allclose( valref, valvec, rtol=1e-6 )
+    print_rate( 'split/stack/unstack', nrows, tref )
+    print_rate( 'vectorized decoding', nrows, tvec )
+
+
+# compares reading existing netcdf files with xray and with netCDF4
+def bench_nc_readers(InNC):
+    print( '.. reading ' + str(len(InNC)) + ' netcdf files' )
+    txr = 0.0
+    tnc = 0.0
+    nrows = 0
+    for f in InNC:
+        xrdf, sec = timeit( wio.open_existing_nc, f )
+        txr = txr + sec
+        ncdf, sec = timeit( wio.open_with_netcdf4, f )
+        tnc = tnc + sec
+        nrows = nrows + len(xrdf)
+        pd.util.testing.assert_frame_equal( xrdf, ncdf, check_dtype=False, 
+                check_less_precise=True )
+    print_rate( 'xray', nrows, txr )
+    print_rate( 'netCDF4', nrows, tnc )
+
+
+# counts data frames created while calling func, returns result, number of 
+# data frames and time elapsed in seconds
+def count_frames(func, *args):
+    init = pd.DataFrame.__init__
+    count = [0]
+    def counted(self, *a, **k):
+        count[0] = count[0] + 1
+        init(self, *a, **k)
+    pd.DataFrame.__init__ = counted
+    try:
+        res, sec = timeit( func, *args )
+    finally:
+        pd.DataFrame.__init__ = init
+    return res, count[0], sec
+
+
+# fits all gates of VAD scans (arrays as used by vad_linear) with run_fit, 
+# returns dictionary of arrays (scan, gate)
+def vad_leastsq(vr, az, ele):
+    res = np.empty( (vr.shape[0], vr.shape[2], len(wt.FitCols)) )
+    for s in range(0, vr.shape[0]):
+        wt.fit_scan(vr[s], az[s], ele[s], res[s])
+
+    return dict( (c, res[..., i]) for i, c in enumerate(wt.FitCols) )
+
+
+# fits all gates of VAD scans with run_fit, but collects results as before in
+# one data frame per range gate, concatenated per scan (reference)
+def vad_gate_frames(vr, az, ele):
+    scans = []
+    for s in range(0, vr.shape[0]):
+        gates = []
+        for g in range(0, vr.shape[2]):
+            ws_out = pd.DataFrame( columns=wt.FitCols, index=[g], 
+                    dtype='float64' )
+            valid = np.isfinite(vr[s, :, g]) & np.isfinite(az[s])
+            if valid.any():
+                ws_out.loc[g] = wt.run_fit( vr[s, valid, g], az[s, valid], 
+                        ele[s], np.empty(len(wt.FitCols)) )
+            gates.append(ws_out)
+        scans.append( pd.concat(gates) )
+
+    return pd.concat(scans)
+
+
+# compares result containers of leastsq fit: one data frame per range gate 
+# and result arrays (scan, gate) with one data frame at the end
+def bench_fit_containers(AllF, sProp):
+    col = cl.VarDict[sProp]['cols'][cl.VarDict[sProp]['N']]
+    tref = 0.0
+    tarr = 0.0
+    nref = 0
+    narr = 0
+    ngates = 0
+    for VADscan in cl.ScanID['VAD']:
+        w = AllF[AllF.scan_ID==VADscan]
+        if len(w)==0:
+            continue
+        starts, stops = wt.scan_limits(w)
+        arrs, az, ele, t0, ranges = wt.scan_arrays(w, starts, stops, [col])
+        ref, n, sec = count_frames( vad_gate_frames, arrs[col], az, ele )
+        tref = tref + sec
+        nref = nref + n
+        wind, n, sec = count_frames( wt.fit_leastsq, w, sProp )
+        tarr = tarr + sec
+        narr = narr + n
+        ngates = ngates + len(wind)
+        np.testing.assert_allclose( ref[wt.FitCols].values, 
+                wind[wt.FitCols].values )
+    print( '.. fit results: %d data frames per gate, %d with result arrays' \
+            % (nref, narr) )
+    print_rate( 'data frame per gate', ngates, tref )
+    print_rate( 'result arrays', ngates, tarr )
+
+
+# compares leastsq fit of VAD scans in one process and in the pool of VAD 
+# fit (scans shared as memory mapped arrays)
+def bench_fit_pool(AllF, sProp):
+    tser = 0.0
+    tpool = 0.0
+    ngates = 0
+    pool = wt.open_pool()
+    for VADscan in cl.ScanID['VAD']:
+        w = AllF[AllF.scan_ID==VADscan]
+        if len(w)==0:
+            continue
+        ser, sec = timeit( wt.fit_leastsq, w, sProp )
+        tser = tser + sec
+        par, sec = timeit( wt.fit_leastsq, w, sProp, pool )
+        tpool = tpool + sec
+        ngates = ngates + len(ser)
+        pd.util.testing.assert_frame_equal( ser, par )
+    wt.close_pool()
+    print_rate( 'leastsq, one process', ngates, tser )
+    print_rate( 'leastsq, pool of ' + str(cl.SWITCH_POOL), ngates, tpool )
+
+
+# compares outlier removal per scan and gate (set_outliers_to_nan) to the 
+# vectorized removal, times linear VAD fit with and without reweighted fits
+def bench_outliers(AllF, sProp):
+    col = cl.VarDict[sProp]['cols'][cl.VarDict[sProp]['N']]
+    niter = max(cl.FitIter, 3)
+    tref = 0.0
+    tvec = 0.0
+    tols = 0.0
+    tirls = 0.0
+    ngates = 0
+    for VADscan in cl.ScanID['VAD']:
+        w = AllF[AllF.scan_ID==VADscan]
+        if len(w)==0:
+            continue
+        starts, stops = wt.scan_limits(w)
+        arrs, az, ele, t0, ranges = wt.scan_arrays(w, starts, stops, [col])
+        vr = arrs[col]
+        ref = vr.copy()
+        t = time.time()
+        for s in range(0, vr.shape[0]):
+            for g in range(0, vr.shape[2]):
+                valid = np.isfinite(ref[s, :, g])
+                ref[s, valid, g] = we.set_outliers_to_nan( ref[s, valid, g] )
+        tref = tref + time.time() - t
+        vec, sec = timeit( wt.outliers_to_nan, vr, cl.OutlierMargin )
+        tvec = tvec + sec
+        np.testing.assert_array_equal( np.isnan(ref), np.isnan(vec) )
+        fit, sec = timeit( wt.vad_linear, vec, az, ele )
+        tols = tols + sec
+        fit, sec = timeit( wt.vad_linear, vec, az, ele, niter )
+        tirls = tirls + sec
+        ngates = ngates + vr.shape[0] * vr.shape[2]
+    print( '.. outlier removal results agree' )
+    print_rate( 'outliers per gate', ngates, tref )
+    print_rate( 'outliers vectorized', ngates, tvec )
+    print_rate( 'linear fit', ngates, tols )
+    print_rate( 'linear fit, ' + str(niter) + ' reweighted', ngates, tirls )
+
+
+# checks that linear VAD fit and leastsq fit (results of vad_linear and 
+# vad_leastsq) accept the same fits and give the same wind (leastsq can return 
+# negative amplitude with phase shifted by 180 degrees)
+def compare_vad_fits(lin, lsq):
+    good = lsq['rsquared']>=0.1
+    np.testing.assert_array_equal( good, lin['rsquared']>=0.1 )
+    np.testing.assert_allclose( lin['rsquared'][good], 
+            lsq['rsquared'][good], atol=1e-3 )
+    np.testing.assert_allclose( lin['wspeed'][good], 
+            np.abs(lsq['wspeed'][good]), atol=0.05 )
+    np.testing.assert_allclose( lin['w'][good], lsq['w'][good], atol=0.05 )
+    wdir = np.where( lsq['wspeed']<0, lsq['wdir'] + 180, lsq['wdir'] ) % 360
+    ddir = (lin['wdir'][good] - wdir[good] + 180) % 360 - 180
+    np.testing.assert_allclose( ddir, 0, atol=0.5 )
+
+
+# compares linear VAD fit and leastsq fit on synthetic VAD scans of known wind 
+# (u, v, w per range gate) with noise, scattered NaN and gates without data 
+# (regression test, needs no input files); stops if results differ
+def check_vad_fit():
+    rs = np.random.RandomState(0)
+    nscan, ngates = 4, 30
+    # azimuth 0 to 360 degrees in steps of 10 (closing beam at 360)
+    az = np.tile( np.arange(0, 361, 10.0), (nscan, 1) )
+    ele = np.array([ 15.0, 15.0, 75.0, 75.0 ])
+    u = rs.uniform(-15, 15, (nscan, ngates))
+    v = rs.uniform(-15, 15, (nscan, ngates))
+    w = rs.uniform(-1, 1, (nscan, ngates))
+    theta = np.radians(az)[:, :, np.newaxis]
+    elevation = np.radians(ele)[:, np.newaxis, np.newaxis]
+    # radial wind positive away from lidar
+    vr = ( u[:, np.newaxis, :] * np.sin(theta) \
+            + v[:, np.newaxis, :] * np.cos(theta) ) * np.cos(elevation) \
+            + w[:, np.newaxis, :] * np.sin(elevation)
+    vr = vr + rs.normal(0, 0.1, vr.shape)
+    vr[ rs.uniform(size=vr.shape)<0.05 ] = np.nan
+    vr[:, :, [3, 17]] = np.nan
+    lin = wt.vad_linear(vr, az, ele)
+    lsq = vad_leastsq(vr, az, ele)
+    compare_vad_fits(lin, lsq)
+    # gates without data are not fitted
+    assert np.all( lin['rsquared'][:, [3, 17]]==-999 )
+    assert np.all( lsq['rsquared'][:, [3, 17]]==-999 )
+    # known wind (direction the wind comes from)
+    good = lin['rsquared']>=0.1
+    wspeed = np.hypot(u, v)
+    wdir = np.degrees( np.arctan2(-u, -v) ) % 360
+    np.testing.assert_allclose( lin['wspeed'][good], wspeed[good], atol=0.2 )
+    np.testing.assert_allclose( lin['w'][good], w[good], atol=0.2 )
+    ddir = (lin['wdir'][good] - wdir[good] + 180) % 360 - 180
+    np.testing.assert_allclose( ddir[wspeed[good]>1], 0, atol=3 )
+    print( '.. VAD fit results agree on synthetic scans' )
+
+
+# compares batched linear VAD fit to leastsq fit per gate (regression test)
+# on the VAD scans of the day, stops if results differ
+def bench_vad_fit(AllF, sProp):
+    col = cl.VarDict[sProp]['cols'][cl.VarDict[sProp]['N']]
+    tlin = 0.0
+    tlsq = 0.0
+    ngates = 0
+    for VADscan in cl.ScanID['VAD']:
+        w = AllF[AllF.scan_ID==VADscan]
+        if len(w)==0:
+            continue
+        starts, stops = wt.scan_limits(w)
+        arrs, az, ele, t0, ranges = wt.scan_arrays(w, starts, stops, [col])
+        lin, sec = timeit( wt.vad_linear, arrs[col], az, ele )
+        tlin = tlin + sec
+        lsq, sec = timeit( vad_leastsq, arrs[col], az, ele )
+        tlsq = tlsq + sec
+        ngates = ngates + lin['rsquared'].size
+        compare_vad_fits(lin, lsq)
+    print( '.. VAD fit results agree' )
+    print_rate( 'leastsq per gate', ngates, tlsq )
+    print_rate( 'linear, all gates', ngates, tlin )
+
+
+# compares regridding of vertical line-of-sight data with 
+# unstack/resample/stack and with the gridding engine (grid_data)
+def bench_grid(AllF):
+    vert = AllF[AllF.ele>=89.5]
+    print( '.. regridding ' + str(len(vert)) + ' rows' )
+    for freq in ['1T', '15T']:
+        ref, tref = timeit( lambda: vert.unstack(level='range')\
+                .resample(freq).stack(level='range') )
+        grid, tgrid = timeit( wt.grid_data, vert, freq )
+        pd.util.testing.assert_frame_equal( ref, grid, check_dtype=False, 
+                check_less_precise=True )
+        print_rate( 'unstack ' + freq, len(vert), tref )
+        print_rate( 'grid_data ' + freq, len(vert), tgrid )
+
+
+# compares time series plot of vertical line of sight with pivot and 
+# pcolormesh, in fast mode (raster drawn as image) and with the raster of the 
+# day (SWITCH_TSRASTER, default) built and refreshed in a temporary raster 
+# file, rendered at once; stops if raster of the day and fast mode differ
+def bench_plot_ts(AllF, sProp):
+    cl.SWITCH_PLOTPOOL = 0
+    cl.SWITCH_PLOTCACHE = False
+    tsraster = cl.SWITCH_TSRASTER
+    ncInput = cl.ncInput
+    cl.SWITCH_TSRASTER = False
+    ref, tref = timeit( wp.plot_ts, AllF, sProp, cl.sDate, ['dummy'] )
+    fast, tfast = timeit( wp.plot_ts, AllF, sProp, cl.sDate, ['dummy','fast'] )
+    cl.SWITCH_TSRASTER = True
+    cl.ncInput = tempfile.mkdtemp() + os.sep
+    try:
+        day, tday = timeit( wp.plot_ts, AllF, sProp, cl.sDate, ['dummy'] )
+        day, tagain = timeit( wp.plot_ts, AllF, sProp, cl.sDate, ['dummy'] )
+        t1, r1, z1 = wp.raster_ts(AllF, sProp)[0:3]
+        t2, r2, z2 = wp.raster_day(AllF, sProp, cl.sDate)[0:3]
+    finally:
+        shutil.rmtree(cl.ncInput)
+        cl.ncInput = ncInput
+        cl.SWITCH_TSRASTER = tsraster
+    ix = np.searchsorted(t2, t1)
+    assert np.array_equal(t2[ix], t1) and np.allclose(r1, r2)
+    assert np.allclose(z1, z2[:, ix], equal_nan=True), \
+            'raster of day differs from fast mode'
+    print_rate( 'plot_ts pcolormesh', len(AllF), tref )
+    print_rate( 'plot_ts fast', len(AllF), tfast )
+    print_rate( 'plot_ts raster of day', len(AllF), tday )
+    print_rate( 'plot_ts raster, no new data', len(AllF), tagain )
+
+
+# compares plots of the low level scans of the day as filled contours and 
+# on the mesh of each scan geometry, rendered at once
+def bench_polar(AllF, sProp):
+    cl.SWITCH_PLOTPOOL = 0
+    cl.SWITCH_PLOTCACHE = False
+    six = wt.scan_index(AllF)
+    for LOWscan in cl.ScanID['LOW']:
+        low, starts, stops = wt.scan_rows(AllF, six, LOWscan)
+        if len(starts)==0:
+            continue
+        for look in ['contour', 'mesh']:
+            cl.SWITCH_POLAR = look
+            res, sec = timeit( wp.plot_low_scan, low, sProp, cl.sDate, 
+                    starts, stops )
+            print_rate( 'scan ' + str(LOWscan) + ' ' + look, len(low), sec )
+
+
+# compares binning the vertical line of sight of the whole day to the raster 
+# of the day (update_raster) and adding only the last hour to it
+def bench_raster(AllF, sProp):
+    cols = [ cl.VarDict[sProp]['cols'][cl.VarDict[sProp]['N']] ]
+    t0 = pd.Timestamp(cl.sDate).value
+    step = 60 * 10**9
+    tn = AllF.index.get_level_values('time').values.view(np.int64)
+    vert = AllF['ele'].values>=89.5
+    early = tn < tn.max() - 3600 * 10**9
+    ras, tras = timeit( wt.update_raster, {}, AllF, cols, t0, step, 1440, vert )
+    old = wt.update_raster({}, AllF, cols, t0, step, 1440, vert & early)[0]
+    new, tnew = timeit( wt.update_raster, old, AllF, cols, t0, step, 1440, vert )
+    for k in ras:
+        if not np.allclose( ras[k], new[k] ):
+            print( '.. raster differs in ' + k )
+    print_rate( 'raster of day', len(AllF), tras )
+    print_rate( 'raster, last hour', len(AllF), tnew )
+
+
+# runs run.main for sProp with compact or wide data types (no plots, netcdf 
+# or cache files written), prints peak RSS of the process in MB
+def main_rss(sProp, compact):
+    import run
+    cl.SWITCH_COMPACT = compact
+    cl.SWITCH_PLOT = False
+    cl.SWITCH_OUTNC = False
+    cl.SWITCH_VADCACHE = False
+    cl.SWITCH_INPUT = 'text'
+    cl.SWITCH_CLEANUP = False
+    run.main(cl.sDate, sProp)
+    print( resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0 )
+
+
+# compares peak RSS of run.main for the whole day with float64/int64 and 
+# compact data types (SWITCH_COMPACT), each in a new process
+def bench_peak_rss(sProp):
+    if resource is None:
+        print( '.. peak RSS not available on this system' )
+        return
+    rss = {}
+    for compact in [False, True]:
+        out = subprocess.check_output([ sys.executable, __file__, 'rss', 
+            sProp, str(compact) ])
+        rss[compact] = float( out.split()[-1] )
+    print( '.. peak RSS of run.main: %.0f MB float64/int64, %.0f MB compact' \
+            % (rss[False], rss[True]) )
+
+
+
+if __name__=="__main__" and sys.argv[1:2]==['rss']:
+    main_rss( sys.argv[2], sys.argv[3]=='True' )
+elif __name__=="__main__" and sys.argv[1:2]==['check']:
+    check_vad_fit()
+elif __name__=="__main__":
+    check_vad_fit()
+    for p in cl.proplist:
+        InTXT = sorted(glob(cl.txtInput + cl.VarDict[p]['fend'] + '.' + cl.ending))
+        if InTXT:
+            bench_get_data(InTXT, p)
+            if p=='spectra':
+                bench_spectra(InTXT)
+            else:
+                AllF = pd.concat([ wio.get_data(f, p) for f in InTXT ])
+                bench_grid(AllF)
+                bench_plot_ts(AllF, p)
+                bench_raster(AllF, p)
+            if p=='wind':
+                AllF = wt.change_scan_IDs(AllF)
+                bench_polar(AllF, p)
+                bench_fit_containers(AllF, p)
+                if cl.SWITCH_POOL>0:
+                    bench_fit_pool(AllF, p)
+                bench_vad_fit(AllF, p)
+                bench_outliers(AllF, p)
+            bench_peak_rss(p)
+        else:
+            print( '.. no text files found for ' + p )
+        fend = cl.VarDict[p]['cols'][cl.VarDict[p]['N']]
+        InNC = sorted(glob(cl.ncInput + fend + '*.nc'))
+        if InNC:
+            bench_nc_readers(InNC)
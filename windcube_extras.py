@@ -12,6 +12,7 @@ import xray
 import pdb
 
 import config_lidar as cl                               # contains all constants
+import windcube_io as wio
 import windcube_tools as wt
 import windcube_plotting as wp
 
@@ -34,21 +35,25 @@ def set_outliers_to_nan(data_points):
 def compare_dbs(DBSdf, p, sDate):
     # get VAD data (requires existing VAD netcdf file)
     VADfile = cl.OutPath + sDate[0:4] + os.sep + sDate + '_VAD' + '_45.nc'
-    VADdf = wt.open_existing_nc(VADfile)
-    VADdfix = VADdf.reset_index()
-    DBSdfix = DBSdf.reset_index()
-    df = pd.merge(VADdfix, DBSdfix, how='outer')
-    df = df.set_index( ['time', 'range'] )
+    # read only VAD variables and times needed for comparison (from DBSmaxage 
+    # before the first DBS profile)
+    tDBS = DBSdf.index.get_level_values('time')
+    VADdf = wio.get_product(sDate, 'VAD_45', VADfile, ['wspeed', 'w', 'wdir'], 
+            [tDBS.min() - np.timedelta64(cl.DBSmaxage, 'm'), tDBS.max()])
+    # VAD result of the last scan before each DBS profile (same range)
+    df = wt.asof_join( DBSdf, VADdf, ['wspeed', 'w', 'wdir'], 
+            np.timedelta64(cl.DBSmaxage, 'm') )
 
     # obtain horizontal wind speed and direction from xwind and ywind
     df['hwind'] = np.sqrt( df.xwind**2 + df.ywind**2 )
     df['hdir'] = np.degrees( np.arctan2( df.xwind, df.xwind ) ) + 180
 
-    # test different averaging
-    df1min = df.unstack('range').resample('1T', fill_method='bfill').stack('range')
-    df2min = df.unstack('range').resample('2T', fill_method='bfill').stack('range')
-    df3min = df.unstack('range').resample('3T', fill_method='bfill').stack('range')
-    df5min = df.unstack('range').resample('5T', fill_method='bfill').stack('range')
+    # test different averaging (all from one pass over the data)
+    pyramid = wt.grid_pyramid(df, [1, 2, 3, 5], fill='bfill')
+    df1min = pyramid[1]
+    df2min = pyramid[2]
+    df3min = pyramid[3]
+    df5min = pyramid[5]
 
     if cl.SWITCH_PLOT:
         # plot correlation of horizontal wind speed
@@ -67,9 +72,11 @@ def compare_dbs(DBSdf, p, sDate):
 
 
 def create_hdcp2_output(sDate):
+    # variables needed for HDCP2 files
+    hdcp2vars = [ cl.AttDict[key][0] for key in cl.AttDict if cl.AttDict[key][7] ]
     # level 1 data
-    winddf = wt.open_existing_nc( cl.DataPath + sDate[0:4] + os.sep + sDate + '_radial_wind_speed.nc' )
-    betadf = wt.open_existing_nc( cl.DataPath + sDate[0:4] + os.sep + sDate + '_beta.nc' )
+    winddf = wio.get_product( sDate, 'radial_wind_speed', cl.DataPath + sDate[0:4] + os.sep + sDate + '_radial_wind_speed.nc', hdcp2vars )
+    betadf = wio.get_product( sDate, 'beta', cl.DataPath + sDate[0:4] + os.sep + sDate + '_beta.nc', hdcp2vars )
     for var in winddf:
         if var in betadf:
             betadf.drop( var, axis=1, inplace=True )
@@ -86,12 +93,12 @@ def create_hdcp2_output(sDate):
     lvl1df = lvl1ds.to_dataframe()
     lvl1ds.close()
     # create output
-    wt.export_to_netcdf( lvl1df, 'hdcp2', sDate, 'level1' )
+    wio.export_to_netcdf( lvl1df, 'hdcp2', sDate, 'level1' )
 
     # level 2 data
-    VADdf = wt.open_existing_nc( cl.DataPath + sDate[0:4] + os.sep + sDate + '_VAD_75.nc' )
+    VADdf = wio.get_product( sDate, 'VAD_75', cl.DataPath + sDate[0:4] + os.sep + sDate + '_VAD_75.nc', hdcp2vars )
     for key in VADdf:
         if key not in cl.AttDict or cl.AttDict[key][7] is False:
             VADdf = VADdf.drop( key, axis=1 )
-    wt.export_to_netcdf( VADdf, 'hdcp2', sDate, 'level2' )
+    wio.export_to_netcdf( VADdf, 'hdcp2', sDate, 'level2' )
 
@@ -1,6 +1,10 @@
 import datetime as dt
 import time
 import os
+import io
+import json
+import multiprocessing as mp
+from glob import glob
 
 import numpy as np
 import pandas as pd
@@ -16,22 +20,387 @@ import windcube_tools as wt
 
 # read text files from MySQL data base, returns pandas data frame
 def get_data(file_path, sProp):
+    if cl.SWITCH_FASTREAD:
+        outdf = read_text_fast(file_path, sProp)
+    else:
+        outdf = read_text(file_path, sProp)
+
+    return prepare_data(outdf)
+
+
+# time stamp format of the text files
+def get_time_format(sProp):
     # dsb text file have a different time stamp
     if sProp=='dbs':
-        dparse = lambda d: dt.datetime.strptime(d, '%Y-%m-%d %H:%M:%S')
+        return '%Y-%m-%d %H:%M:%S'
     else:
-        dparse = lambda d: dt.datetime.strptime(d, '%Y-%m-%d %H:%M:%S.%f')
-    
+        return '%Y-%m-%d %H:%M:%S.%f'
+
+
+# data types of the text file columns (except time) as declared in VarDict;
+# compact data types (SWITCH_COMPACT): float32 for measured values (range is
+# float64 as it becomes part of the index), int16 for IDs and int8 for 
+# status; otherwise widened to the types the python parser would return
+def get_dtypes(sProp):
+    dtypes = {}
+    for c in range( 1, len(cl.VarDict[sProp]['cols']) ):
+        col = cl.VarDict[sProp]['cols'][c]
+        ty = np.dtype( cl.VarDict[sProp]['ty'][c] )
+        # spectra are stored as comma separated string
+        if sProp=='spectra' and col=='spectra':
+            dtypes[col] = object
+        elif ty.kind=='f' and cl.SWITCH_COMPACT and col<>'range':
+            dtypes[col] = np.float32
+        elif ty.kind=='f':
+            dtypes[col] = np.float64
+        elif cl.SWITCH_COMPACT and ty.itemsize==1:
+            dtypes[col] = np.int8
+        elif cl.SWITCH_COMPACT:
+            dtypes[col] = np.int16
+        else:
+            dtypes[col] = np.int64
+
+    return dtypes
+
+
+# reads text file with the python parser and a time stamp parser per row
+# (file_path can also be an open file; skiprows defaults to cl.skip)
+def read_text(file_path, sProp, skiprows=None):
+    if skiprows is None:
+        skiprows = cl.skip
+    tformat = get_time_format(sProp)
+    dparse = lambda d: dt.datetime.strptime(d, tformat)
+
     outdf = pd.read_csv(file_path, sep=cl.sep,          # read file from csv
-            header=None, 
-            skiprows=cl.skip,
+            header=None,
+            skiprows=skiprows,
             engine='python',
             names=cl.VarDict[sProp]['cols'],
             parse_dates=[0],                            # feed the first column to the parser
-            date_parser=dparse, 
+            date_parser=dparse,
             squeeze=True                                # convert to `Series` object because we only have one column
             )
+    # same data types as C parser
+    if cl.SWITCH_COMPACT:
+        for col, dtype in get_dtypes(sProp).items():
+            outdf[col] = outdf[col].astype(dtype)
+
+    return outdf
+
+
+# reads text file with the C parser, columns are read straight into the
+# data types given in VarDict and time stamps are parsed in one step;
+# returns an iterator of data frames if chunksize is given
+def read_text_fast(file_path, sProp, chunksize=None, skiprows=None):
+    if skiprows is None:
+        skiprows = cl.skip
+    # C parser only handles single character separators (e.g. ', ' -> ',')
+    if len(cl.sep)>1:
+        sep = cl.sep.strip()
+    else:
+        sep = cl.sep
+    reader = pd.read_csv(file_path, sep=sep,
+            header=None,
+            skiprows=skiprows,
+            skipinitialspace=(sep<>cl.sep),
+            engine='c',
+            names=cl.VarDict[sProp]['cols'],
+            dtype=get_dtypes(sProp),
+            chunksize=chunksize
+            )
+    if chunksize is None:
+        return parse_time(reader, sProp)
+    else:
+        return (parse_time(chunk, sProp) for chunk in reader)
+
+
+# converts time stamp strings of the first column to datetime (vectorized)
+def parse_time(outdf, sProp):
+    outdf['time'] = pd.to_datetime(outdf['time'], format=get_time_format(sProp))
+
+    return outdf
+
+
+# reads text files in chunks and yields one scan at a time; a scan ends
+# where the (composite) scan ID changes or after a time gap of ScanGap,
+# rows of a scan are kept together across chunk and file borders
+def iter_scans(InTXT, sProp):
+    rest = None
+    for f in InTXT:
+        printif('... streaming file ' + f)
+        if cl.SWITCH_FASTREAD:
+            chunks = read_text_fast(f, sProp, chunksize=cl.chunk)
+        else:
+            chunks = [read_text(f, sProp)]
+        for chunk in chunks:
+            if rest is not None:
+                chunk = pd.concat([rest, chunk], ignore_index=True)
+            starts = find_scan_starts(chunk)
+            # yield complete scans, keep last scan until next chunk is read
+            for s0, s1 in zip(starts[:-1], starts[1:]):
+                yield prepare_data( chunk.iloc[s0:s1].copy() )
+            rest = chunk.iloc[starts[-1]:]
+    if rest is not None and len(rest)>0:
+        yield prepare_data( rest.copy() )
+
+
+# returns row positions where a new scan starts (first row included)
+def find_scan_starts(chunk):
+    newscan = np.diff(chunk['time'].values) > np.timedelta64(cl.ScanGap, 's')
+    if 'scan_ID' in chunk:
+        sID = wt.composite_scan_IDs( chunk['scan_ID'].values )
+        newscan = newscan | (np.diff(sID)<>0)
+
+    return np.concatenate([ [0], np.where(newscan)[0] + 1 ])
+
+
+# reads lines added to the text files since the last run and yields one scan
+# at a time; state holds byte offset, time of last row read and file size 
+# per file and is updated when the generator is exhausted; the last scan is 
+# held back (offset is not moved past its first row) while it may still be 
+# written (see scan_complete); a file shorter than read before is read again 
+# from the beginning
+def iter_new_scans(InTXT, sProp, state):
+    rest = None
+    ends = {}   # byte offset after last complete line, per file
+    lasts = {}  # time of last row yielded, per file
+    sizes = {}  # file size in this run and in the last run, per file
+    for n, f in enumerate(InTXT):
+        name = os.path.basename(f)
+        offset, last = state.get(name, [0, ''])[0:2]
+        # size of file read before (offset in states of older versions)
+        size = ( state.get(name, [0, '']) + [offset] )[2]
+        if os.path.getsize(f)<size:
+            # file was rewritten shorter, read again from the beginning
+            offset = 0
+            size = -1
+        elif os.path.getsize(f)<=offset:
+            continue
+        sizes[name] = [ os.path.getsize(f), size ]
+        printif('... reading new lines of file ' + f)
+        new, ends[name] = read_new_lines(f, sProp, offset, n)
+        if new is None:
+            continue
+        # skip rows read before (e.g. if file was rewritten)
+        if last<>'':
+            new = new[new['time'] > pd.Timestamp(last)]
+        if rest is not None:
+            new = pd.concat([rest, new], ignore_index=True)
+        starts = find_scan_starts(new)
+        # yield complete scans, last scan may go on in next file
+        for s0, s1 in zip(starts[:-1], starts[1:]):
+            yield new_scan(new.iloc[s0:s1], InTXT, lasts)
+        rest = new.iloc[starts[-1]:]
+
+    if rest is not None and len(rest)>0 and \
+            scan_complete(InTXT, rest['_file'].values[-1], sizes):
+        yield new_scan(rest, InTXT, lasts)
+        rest = None
+
+    # update state, held back rows are read again in the next run
+    for n, f in enumerate(InTXT):
+        name = os.path.basename(f)
+        if name not in ends:
+            continue
+        offset = ends[name]
+        if rest is not None:
+            held = rest['_pos'][ rest['_file']==n ]
+            if len(held)>0:
+                offset = held.min()
+        last = lasts.get( name, state.get(name, [0, ''])[1] )
+        state[name] = [ int(offset), last, int(sizes[name][0]) ]
+
+
+# checks from the files if the last scan (last row in file number n of 
+# InTXT) is complete: a later file was started, its file has not grown since 
+# the last run (sizes in this and the last run per file) or was not modified 
+# for ScanGap seconds
+def scan_complete(InTXT, n, sizes):
+    if n < len(InTXT)-1:
+        return True
+    size, size0 = sizes[ os.path.basename(InTXT[n]) ]
+    if size==size0:
+        return True
+
+    return time.time() - os.path.getmtime(InTXT[n]) > cl.ScanGap
+
+
+# returns scan without the read position columns, remembers time of its 
+# last row per file
+def new_scan(scan, InTXT, lasts):
+    for n, t in scan.groupby('_file')['time'].max().iteritems():
+        lasts[ os.path.basename(InTXT[n]) ] = str(t)
 
+    return prepare_data( scan.drop(['_file', '_pos'], axis=1) )
+
+
+# reads complete lines of text file starting at byte offset; adds number n
+# of the file and byte position of each line; returns data frame (or None 
+# if no complete line was added) and byte offset after last complete line
+def read_new_lines(file_path, sProp, offset, n):
+    with open(file_path, 'rb') as fh:
+        fh.seek(offset)
+        data = fh.read()
+    data = data[ : data.rfind('\n')+1 ]
+    end = offset + len(data)
+    # skip header only at the beginning of the file
+    if offset==0:
+        skiprows = cl.skip
+    else:
+        skiprows = 0
+    buf = np.frombuffer(data, dtype=np.uint8)
+    nl = np.where( buf==ord('\n') )[0]
+    if len(nl)<=skiprows:
+        return None, end
+    # start and end (newline) of each line after the header
+    starts = np.concatenate([ [0], nl[:-1]+1 ])[skiprows:]
+    stops = nl[skiprows:]
+    # only lines with other characters than white space give a row, parse 
+    # only those to know the byte position of each row
+    text = ~np.in1d( buf, [ord(' '), ord('\t'), ord('\r'), ord('\n')] )
+    ntext = np.concatenate([ [0], np.cumsum(text) ])
+    filled = ntext[stops] > ntext[starts]
+    if not np.any(filled):
+        return None, end
+    lines = buf[ starts[0]: ][ np.repeat(filled, stops - starts + 1) ].tostring()
+    pos = offset + starts[filled]
+    if cl.SWITCH_FASTREAD:
+        new = read_text_fast(io.BytesIO(lines), sProp, skiprows=0)
+    else:
+        new = read_text(io.BytesIO(lines), sProp, skiprows=0)
+    if len(new)<>len(pos):
+        raise ValueError('rows read from ' + file_path + ' don\'t match lines')
+    new['_file'] = n
+    new['_pos'] = pos
+
+    return new, end
+
+
+# reads state of incremental input (offset and time of last row per file)
+def read_state(statefile):
+    if os.path.exists(statefile):
+        with open(statefile, 'r') as fh:
+            return json.load(fh)
+    else:
+        return {}
+
+
+# writes state of incremental input
+def write_state(statefile, state):
+    with open(statefile, 'w') as fh:
+        json.dump(state, fh, indent=1, sort_keys=True)
+
+
+# reads cache of fitted VAD scans (dictionary, see windcube_tools.fit_cached)
+def read_cache(cachefile):
+    if os.path.exists(cachefile):
+        return pd.read_pickle(cachefile)
+    else:
+        return {}
+
+
+# writes cache of fitted VAD scans
+def write_cache(cachefile, cache):
+    pd.to_pickle(cache, cachefile)
+
+
+# reads raster of binned data of the day (dictionary of arrays, see 
+# windcube_tools.update_raster), empty if the file doesn't exist
+def read_raster(rasterfile):
+    if os.path.exists(rasterfile):
+        f = np.load(rasterfile)
+        ras = dict( (k, f[k]) for k in f.files )
+        f.close()
+        return ras
+    else:
+        return {}
+
+
+# writes raster of binned data of the day
+def write_raster(rasterfile, ras):
+    np.savez(rasterfile, **ras)
+
+
+# appends data frame to columnar day store in directory storepath (one flat 
+# binary file per column, rows in time order); rows not newer than the last 
+# stored row are skipped, the row count in the meta file marks valid data;
+# raises ValueError for string columns (nothing is written)
+def store_append(storepath, df):
+    if not os.path.exists(storepath):
+        os.makedirs(storepath)
+    meta = read_store_meta(storepath)
+    flat = df.reset_index()
+    if meta['nrows']>0:
+        tlast = store_column(storepath, meta, 'time')[-1]
+        flat = flat[ flat['time'].values.view(np.int64) > tlast ]
+    if len(flat)==0:
+        return
+    # stable sort keeps order of range gates of one time stamp
+    flat = flat.sort_values('time', kind='mergesort')
+    # strings (e.g. spectra) have no fixed size, the text files are needed
+    strcols = [ col for col in flat if flat[col].dtype==object ]
+    if strcols:
+        raise ValueError('columns ' + ', '.join(strcols) \
+                + ' can not be stored in day store ' + storepath)
+    if meta['cols']==[]:
+        meta['cols'] = [ [col, str(flat[col].dtype)] for col in flat ]
+    for col, dtype in meta['cols']:
+        arr = np.ascontiguousarray( flat[col].values.astype(dtype) )
+        if dtype.startswith('datetime64'):
+            arr = arr.view(np.int64)
+        with open(storepath + col + '.bin', 'ab') as fh:
+            # cut data of an interrupted previous append
+            fh.truncate( meta['nrows'] * arr.itemsize )
+            arr.tofile(fh)
+    meta['nrows'] = meta['nrows'] + len(flat)
+    write_state(storepath + 'meta.json', meta)
+
+
+# opens columnar day store, returns data frame with time and range as index;
+# reads only columns cols (all if None) and time window tlim [start, end)
+def store_open(storepath, cols=None, tlim=None):
+    meta = read_store_meta(storepath)
+    if meta['nrows']==0:
+        return pd.DataFrame()
+    # time is the index of the store (sorted)
+    t = store_column(storepath, meta, 'time')
+    if tlim is None:
+        i0, i1 = 0, meta['nrows']
+    else:
+        i0, i1 = np.searchsorted( t, 
+                np.array(tlim, dtype='datetime64[ns]').view(np.int64) )
+    outdict = {}
+    for col, dtype in meta['cols']:
+        if col in ['time', 'range'] or cols is None or col in cols:
+            arr = np.array( store_column(storepath, meta, col)[i0:i1] )
+            if dtype.startswith('datetime64'):
+                arr = arr.view(dtype)
+            outdict[col] = arr
+    order = [ col for col, dtype in meta['cols'] if col in outdict ]
+
+    return pd.DataFrame(outdict, columns=order).set_index(['time', 'range'])
+
+
+# returns memory map of one column of the day store
+def store_column(storepath, meta, col):
+    dtype = dict(meta['cols'])[col]
+    if dtype.startswith('datetime64'):
+        dtype = np.int64
+    return np.memmap(storepath + col + '.bin', dtype=dtype, mode='r', 
+            shape=(meta['nrows'],))
+
+
+# reads meta data of day store (number of rows, column names and types)
+def read_store_meta(storepath):
+    meta = read_state(storepath + 'meta.json')
+    if meta=={}:
+        meta = {'nrows' : 0, 'cols' : []}
+
+    return meta
+
+
+# removes duplicates, converts units and sets time and range as index
+def prepare_data(outdf):
     outdf.drop_duplicates( inplace=True )
     # convert azimuth range from -180 - 180 degrees to 0 - 360 degrees
     outdf.loc[outdf.azi < 0, 'azi'] = outdf.loc[outdf.azi < 0, 'azi'] + 360
@@ -45,41 +414,99 @@ def get_data(file_path, sProp):
     return outdf
 
 
-# opens existing netcdf and returns pandas data frame
-def open_existing_nc(InFile):
-    # open netcdf files
-    xds = xray.open_dataset(InFile, decode_times=True ).transpose()
+# opens existing netcdf and returns pandas data frame; reads only the 
+# variables in varlist (all if None), times within tlim [start, end] and 
+# scans with IDs in scanIDs from disk
+def open_existing_nc(InFile, varlist=None, tlim=None, scanIDs=None):
+    # open netcdf files (variables are read from disk when accessed)
+    xin = xray.open_dataset(InFile, decode_times=True )
+    xds = xin
+    if tlim is not None:
+        xds = xds.sel( time=slice(tlim[0], tlim[1]) )
+    if scanIDs is not None and 'scan_ID' in xds:
+        xds = xds.isel( time=np.where( np.in1d(xds['scan_ID'].values, scanIDs) )[0] )
+    if varlist is not None:
+        xds = xds[ [ v for v in varlist if v in xds.data_vars ] ]
     # convert to pandas data frame
-    dfnc = xds.to_dataframe()
+    dfnc = xds.transpose().to_dataframe()
     # swap order of indices (first time, then range)
     dfswap = dfnc.swaplevel('time','range')
-    xds.close()
+    xin.close()
 
     return dfswap
 
 
-# opens existing netcdf using netCDF4 and returns pandas data frame
-def open_with_netcdf4(InFile):
+# opens existing netcdf using netCDF4 and returns pandas data frame (same 
+# as open_existing_nc, but reads variables straight to numpy arrays); 
+# varlist, tlim and scanIDs select data as in open_existing_nc
+def open_with_netcdf4(InFile, varlist=None, tlim=None, scanIDs=None):
     from netCDF4 import Dataset
     # read netcdf files
     invars = Dataset(InFile, 'r')
-    # put array data to dict
+    # data with more than 2 dimensions (spectra) is read with xray
+    if max([ len(invars.variables[var].dimensions) for var in invars.variables ])>2:
+        invars.close()
+        return open_existing_nc(InFile, varlist, tlim, scanIDs)
+    t = nc_time( invars.variables['time'] )
+    r = nc_array( invars.variables['range'][:] )
+    # select time window and scans
+    if tlim is None:
+        i0, i1 = 0, len(t)
+    else:
+        tl = np.array(tlim, dtype='datetime64[ns]')
+        i0 = np.searchsorted( t, tl[0] )
+        i1 = np.searchsorted( t, tl[1], side='right' )
+    t = t[i0:i1]
+    if scanIDs is not None and 'scan_ID' in invars.variables:
+        tsel = np.in1d( nc_array( invars.variables['scan_ID'][i0:i1] ), scanIDs )
+    else:
+        tsel = np.ones( len(t), dtype=bool )
+    t = t[tsel]
+    nt = len(t)
+    nr = len(r)
+    # put array data to dict, order of rows as in open_existing_nc 
+    # (all times of first range, all times of second range, ...)
     indict = {}
     namelist = []
-    rangeshape = np.shape(invars.variables['range'][:])
     for var in invars.variables:
-        inarr = invars.variables[var][:]
-        if len(np.shape(inarr))==2:
-            inarr = inarr.reshape( np.shape(inarr)[0]*np.shape(inarr)[1], )
-        elif len(np.shape(inarr))==1:
-            inarr = np.tile( inarr, rangeshape[1] )
+        if var in ['time', 'range'] or (varlist is not None and var not in varlist):
+            continue
+        ncvar = invars.variables[var]
+        if len(ncvar.dimensions)==2:
+            if ncvar.dimensions[0]=='time':
+                inarr = nc_array( ncvar[i0:i1, :] )[tsel, :].T
+            else:
+                inarr = nc_array( ncvar[:, i0:i1] )[:, tsel]
+            inarr = inarr.reshape( nt*nr, )
+        elif len(ncvar.dimensions)==1:
+            inarr = np.tile( nc_array( ncvar[i0:i1] )[tsel], nr )
+        else:
+            inarr = np.repeat( nc_array( ncvar[:] ), nt*nr )
         indict[var] = inarr 
         namelist.append(var)
-    # create pandas data frame
-    df = pd.DataFrame(columns=namelist)
-    df.from_dict( indict )
+    invars.close()
+    # create pandas data frame with time and range as index
+    ix = pd.MultiIndex.from_arrays( [np.tile(t, nr), np.repeat(r, nt)], 
+            names=['time', 'range'] )
+
+    return pd.DataFrame(indict, index=ix, columns=namelist)
 
-    return df
+
+# returns netcdf4 variable data as numpy array, masked values are NaN
+def nc_array(inarr):
+    if np.ma.is_masked(inarr):
+        return np.ma.filled( inarr.astype(np.float64), np.nan )
+    else:
+        return np.ma.getdata(inarr)
+
+
+# returns time variable of netcdf file as datetime64 array
+def nc_time(ncvar):
+    if ncvar.units.startswith('seconds since 1970-01-01'):
+        return pd.to_datetime( nc_array(ncvar[:]), unit='s' ).values
+    else:
+        from netCDF4 import num2date
+        return pd.to_datetime( num2date(ncvar[:], ncvar.units) ).values
 
 
 # adds attribute to netcdf variable, if field is not empty
@@ -118,35 +545,108 @@ def all_att_to_df(df, df1D, vname, p, n):
 
 
 # prepares pandas data frame for export to netcdf file
-def export_to_netcdf(df,sProp,sDate,nameadd):
+# (scanadd is added to the scan ID in the file name, six is the scan index 
+# of df if known, see windcube_tools.scan_index)
+def export_to_netcdf(df,sProp,sDate,nameadd,scanadd='',six=None):
     printif('.... convert from df to xray ds')
     if nameadd == '':
-        sID = df.scan_ID.unique()
-        for s in sID:
-            dfsID = df[df['scan_ID']==s].copy()
-            # put spectra data in 3 dimensions (time, range, frequency)
-            if sProp=='spectra':
-                specS = dfsID.spectra.str.split(',', expand=True).astype(float).stack()
-                specdf = specS.to_frame()
-                # add frequency index
-                specdf.reset_index(inplace=True)
-                specdf.rename( columns={ 'level_2' : 'frequency_bins' }, inplace=True )
-                specdf.set_index(['time','range','frequency_bins'], inplace = True)
-                fbix = specdf.unstack().columns.labels[1]
-                vals = specdf.unstack().unstack().values
-                vals = vals.reshape( np.shape(vals)[0], np.shape(vals)[1]/len(fbix), len(fbix) )
-            else:
-                fbix = 'dummy'
-                vals = 'dummy'
-            create_xray_dataset(dfsID, nameadd, s, sProp, sDate, fbix, vals)
+        if six is not None:
+            # take rows of each scan ID from scan index (one scan ID at a time)
+            sIDs = six['scan_ID'].unique()
+            groups = ( (s, wt.scan_rows(df, six, s)[0]) for s in sIDs )
+        else:
+            # split data frame by scan ID in one pass
+            sIDs = df['scan_ID'].unique()
+            groups = df.groupby('scan_ID', sort=False)
+        if cl.SWITCH_EXPORTPOOL>0 and len(sIDs)>1:
+            # write files of different scan IDs in parallel
+            pool = mp.Pool( processes=min(cl.SWITCH_EXPORTPOOL, len(sIDs)) )
+            poolres = [ pool.apply_async(export_scan, 
+                args=(dfsID, s, sProp, sDate, nameadd, scanadd)) \
+                        for s, dfsID in groups ]
+            pool.close()
+            pool.join()
+            # raise errors of workers
+            OutFiles = [ res.get() for res in poolres ]
+        else:
+            OutFiles = [ export_scan(dfsID, s, sProp, sDate, nameadd, scanadd) \
+                    for s, dfsID in groups ]
     elif 'VAD' in nameadd:
         fbix = 'dummy'
         vals = 'dummy'
-        create_xray_dataset(df, nameadd, 'VAD', sProp, sDate, fbix, vals)
+        OutFiles = [ create_xray_dataset(df, nameadd, 'VAD', sProp, sDate, fbix, vals) ]
+    else:
+        OutFiles = []
+    # add new files to catalog of all products
+    if cl.SWITCH_CATALOG and OutFiles:
+        update_catalog(OutFiles)
+
+
+# exports data of one scan ID to netcdf file
+def export_scan(dfsID, s, sProp, sDate, nameadd, scanadd):
+    # put spectra data in 3 dimensions (time, range, frequency)
+    if sProp=='spectra':
+        # decode only records to be written
+        dfsID = rows_to_append( dfsID, 
+                nc_file_name(nameadd, str(s) + scanadd, sProp, sDate) )
+        if len(dfsID)==0:
+            return nc_file_name(nameadd, str(s) + scanadd, sProp, sDate)
+        fbix, vals = decode_spectra(dfsID)
+        # strings are not needed any more
+        dfsID['spectra'] = np.nan
+    else:
+        fbix = 'dummy'
+        vals = 'dummy'
+
+    return create_xray_dataset(dfsID, nameadd, str(s) + scanadd, sProp, sDate, fbix, vals)
+
+
+# decodes comma separated spectra strings to 3-dim array (time, range, 
+# frequency bin); time and range are sorted as in the xray data set, 
+# missing spectra are NaN; returns frequency bin index and array
+def decode_spectra(dfsID):
+    t = dfsID.index.get_level_values('time').values
+    r = dfsID.index.get_level_values('range').values
+    times = np.unique(t)
+    ranges = np.unique(r)
+    # parse all spectra at once
+    nbins = dfsID['spectra'].iloc[0].count(',') + 1
+    spec = np.fromstring( ','.join(dfsID['spectra'].values), 
+            dtype=np.float32, sep=',' )
+    if len(spec)<>len(dfsID)*nbins:
+        raise ValueError('spectra have different numbers of frequency bins')
+    vals = np.empty( (len(times), len(ranges), nbins), dtype=np.float32 )
+    vals.fill(np.nan)
+    vals[ np.searchsorted(times, t), np.searchsorted(ranges, r), : ] = \
+            spec.reshape( len(dfsID), nbins )
+
+    return np.arange(nbins), vals
+
+
+# decodes spectra strings with split, stack and unstack (reference for 
+# decode_spectra, used in windcube_benchmark)
+def decode_spectra_unstack(dfsID):
+    specS = dfsID.spectra.str.split(',', expand=True).astype(float).stack()
+    specdf = specS.to_frame()
+    # add frequency index
+    specdf.reset_index(inplace=True)
+    specdf.rename( columns={ 'level_2' : 'frequency_bins' }, inplace=True )
+    specdf.set_index(['time','range','frequency_bins'], inplace = True)
+    fbix = specdf.unstack().columns.labels[1]
+    vals = specdf.unstack().unstack().values
+    vals = vals.reshape( np.shape(vals)[0], np.shape(vals)[1]/len(fbix), len(fbix) )
+
+    return fbix, vals
 
 
 # exports xray data set to netcdf file, including global attributes, long names and units
+# returns name of file
 def create_xray_dataset(df, nameadd, s, sProp, sDate, fbix, vals):
+    OutFile = nc_file_name(nameadd, s, sProp, sDate)
+    # only records from last record of existing file on (SWITCH_NCAPPEND)
+    df = rows_to_append(df, OutFile)
+    if len(df)==0:
+        return OutFile
     # change time index to seconds since 1970 for storing in netcdf
     df.reset_index(inplace = True)
     tdt = df['time']
@@ -154,6 +654,13 @@ def create_xray_dataset(df, nameadd, s, sProp, sDate, fbix, vals):
     r = df['range']
     df['time'] = t
     df.set_index(['time','range'], inplace = True)
+    # products keep the data types of the text files (float64, int64) also 
+    # if the data is kept in compact types in memory (SWITCH_COMPACT)
+    for col in df:
+        if df[col].dtype.kind in 'fi' and df[col].dtype.itemsize<8:
+            df[col] = df[col].astype( df[col].dtype.kind + '8' )
+    if sProp=='spectra':
+        vals = vals.astype(np.float64)
     xData = xray.Dataset.from_dataframe(df)
     xData1Ddict = {}
     # add variable attributes
@@ -206,6 +713,23 @@ def create_xray_dataset(df, nameadd, s, sProp, sDate, fbix, vals):
     xOut['year'] = np.int16( sDate[0:4] )
     xOut['month'] = np.int16( sDate[4:6] )
     xOut['day'] = np.int16( sDate[6:] )
+    # export file
+    if cl.SWITCH_NCAPPEND:
+        append_to_nc(xOut, OutFile)
+    else:
+        xOut.to_netcdf(path=OutFile,
+                mode='w', engine='netcdf4')#, format='NETCDF4')
+    xOut.close()
+
+    return OutFile
+
+
+# returns name of netcdf file of product (see create_xray_dataset)
+def nc_file_name(nameadd, s, sProp, sDate):
+    if 'VAD' in nameadd:
+        pname='VAD'
+    else:
+        pname=sProp
     # specify file name ending
     if sProp=='dbs':
         nameadd = 'DBS'
@@ -216,10 +740,260 @@ def create_xray_dataset(df, nameadd, s, sProp, sDate, fbix, vals):
             nameadd = nameadd[1:]
         else:
             nameadd = cl.VarDict[pname]['cols'][cl.VarDict[pname]['N']] + nameadd + '_scanID_' + str(s)
-    # export file
-    xOut.to_netcdf(path=cl.OutPath + sDate + '_' + nameadd + '.nc',
-            mode='w', engine='netcdf4')#, format='NETCDF4')
-    xOut.close()
+
+    return cl.OutPath + sDate + '_' + nameadd + '.nc'
+
+
+# returns rows of data frame df (index time and range) from the time of the 
+# last record in netcdf file OutFile on (SWITCH_NCAPPEND): earlier records 
+# are complete and unchanged, the last record (e.g. VAD of a scan that was 
+# not complete) is written again; all rows if the file doesn't exist
+def rows_to_append(df, OutFile):
+    if not cl.SWITCH_NCAPPEND or not os.path.exists(OutFile):
+        return df
+    from netCDF4 import Dataset
+    ncin = Dataset(OutFile, 'r')
+    told = ncin.variables['time'][:]
+    ncin.close()
+    if len(told)==0:
+        return df
+    # time in netcdf file in seconds since 1970
+    t = df.index.get_level_values('time').values.view(np.int64) // 10**9
+    new = t >= np.max(told)
+    if np.all(new):
+        return df
+    else:
+        return df[new].copy()
+
+
+# writes times of xray data set to the existing netcdf file in place from the 
+# first stored time not before the first time of the data set on: records of 
+# the same time are replaced (e.g. scans fitted again after they completed), 
+# the others are kept, time stays sorted; creates the file if not existing, 
+# rewrites it if variables or other dimensions (range) differ
+def append_to_nc(xOut, OutFile):
+    from netCDF4 import Dataset
+    if not os.path.exists(OutFile):
+        write_nc(xOut, OutFile)
+        return
+    ncout = Dataset(OutFile, 'a')
+    told = ncout.variables['time'][:]
+    tnew = xOut['time'].values
+    same = all([ v in ncout.variables for v in xOut.variables ])
+    for d in xOut.dims:
+        if d<>'time' and same:
+            same = d in ncout.variables and \
+                    np.array_equal( ncout.variables[d][:], xOut[d].values )
+    if not same:
+        # merge with existing data and rewrite
+        ncout.close()
+        xOld = xray.open_dataset(OutFile, decode_times=False).load()
+        xOld.close()
+        keep = np.where( ~np.in1d(xOld['time'].values, tnew) )[0]
+        tvars = [ v for v in xOut.data_vars if 'time' in xOut[v].dims ]
+        xKeep = xOld[ [ v for v in tvars if v in xOld ] ].isel(time=keep)
+        # variables new in the data set are NaN for the old records
+        for v in tvars:
+            if v not in xKeep:
+                for d in xOut[v].dims:
+                    if d not in xKeep.dims:
+                        xKeep.coords[d] = xOut[d].values
+                shape = [ xKeep.dims[d] for d in xOut[v].dims ]
+                xKeep[v] = ( xOut[v].dims, np.nan * np.ones(shape) )
+                xKeep[v].attrs = xOut[v].attrs
+        xAll = xray.concat( [xKeep, xOut[tvars]], dim='time' )
+        xAll = xAll.isel( time=np.argsort(xAll['time'].values, kind='mergesort') )
+        for v in xOut.variables:
+            if v not in xAll:
+                xAll[v] = xOut[v]
+        xAll.attrs = xOut.attrs
+        printif('..... rewriting ' + OutFile)
+        write_nc(xAll, OutFile)
+        return
+    if len(tnew)==0:
+        ncout.close()
+        return
+    # rewrite records from first overlapping time on, keep old records of 
+    # times not in the data set
+    n0 = np.searchsorted( told, tnew.min() )
+    keep = n0 + np.where( ~np.in1d(told[n0:], tnew) )[0]
+    order = np.argsort( np.concatenate([ told[keep], tnew ]), kind='mergesort' )
+    n1 = n0 + len(order)
+    for v in xOut.variables:
+        if 'time' in xOut[v].dims:
+            ncvar = ncout.variables[v]
+            ncvar.set_auto_mask(False)
+            vals = nc_values( xOut[v].transpose(*ncvar.dimensions).values )
+            ax = ncvar.dimensions.index('time')
+            ix = [ slice(None) ] * len(ncvar.dimensions)
+            if len(keep)>0:
+                ix[ax] = keep
+                vals = np.concatenate([ ncvar[tuple(ix)], vals ], axis=ax)
+            ix[ax] = slice(n0, n1)
+            ncvar[tuple(ix)] = np.take(vals, order, axis=ax)
+    ncout.setncattr( 'Processing_date', xOut.attrs['Processing_date'] )
+    ncout.close()
+
+
+# writes xray data set to zlib compressed netcdf4 file with unlimited time 
+# dimension, chunked in time (NCchunk time steps)
+def write_nc(xOut, OutFile):
+    from netCDF4 import Dataset
+    ncout = Dataset(OutFile, 'w', format='NETCDF4')
+    for d in xOut.dims:
+        if d=='time':
+            ncout.createDimension(d, None)
+        else:
+            ncout.createDimension(d, xOut.dims[d])
+    for v in xOut.variables:
+        vals = nc_values( xOut[v].values )
+        dims = xOut[v].dims
+        if vals.dtype.kind=='f':
+            fill = np.nan
+        else:
+            fill = None
+        if len(dims)>0:
+            chunks = [ min(cl.NCchunk, xOut.dims[d]) if d=='time' \
+                    else xOut.dims[d] for d in dims ]
+            chunks = [ max(c, 1) for c in chunks ]
+            ncvar = ncout.createVariable(v, vals.dtype, dims, zlib=True, 
+                    complevel=cl.NCcomplevel, chunksizes=chunks, 
+                    fill_value=fill)
+        else:
+            ncvar = ncout.createVariable(v, vals.dtype, dims, fill_value=fill)
+        ncvar.setncatts( dict( (k, xOut[v].attrs[k]) for k in xOut[v].attrs \
+                if k<>'_FillValue' ) )
+        ncvar[:] = vals
+    ncout.setncatts(xOut.attrs)
+    ncout.close()
+
+
+# returns array in data type that can be stored in netcdf file
+def nc_values(vals):
+    if vals.dtype==bool:
+        return vals.astype(np.int8)
+    else:
+        return vals
+
+
+# columns of catalog of products
+CatCols = ['path', 'variable', 'scan_ID', 'tstart', 'tend', 'rmin', 'rmax', 
+        'ele', 'mtime']
+
+
+# updates catalog of products with netcdf files in list (or all netcdf 
+# files in output path if None); files not changed since last update are 
+# skipped, catalog has one row per file
+def update_catalog(OutFiles=None):
+    if OutFiles is None:
+        OutFiles = sorted( glob(cl.OutPath + '*.nc') \
+                + glob(cl.OutPath + '*' + os.sep + '*.nc') )
+    cat = read_catalog()
+    known = dict( zip(cat['path'], cat['mtime']) )
+    rows = []
+    for f in OutFiles:
+        mtime = os.path.getmtime(f)
+        if known.get(f)<>mtime:
+            rows.append( catalog_entry(f, mtime) )
+    if rows:
+        new = pd.DataFrame(rows, columns=CatCols)
+        cat = pd.concat([ cat[ ~cat['path'].isin(new['path']) ], new ])
+        cat.to_csv(cl.CatalogFile, index=False)
+
+
+# reads catalog of products, returns data frame (one row per file)
+def read_catalog():
+    if os.path.exists(cl.CatalogFile):
+        return pd.read_csv(cl.CatalogFile, parse_dates=['tstart', 'tend'])
+    else:
+        return pd.DataFrame(columns=CatCols)
+
+
+# returns catalog entry of netcdf file: variable and scan ID (from file 
+# name), time and range span and mean elevation
+def catalog_entry(InFile, mtime):
+    from netCDF4 import Dataset
+    # file name is YYYYMMDD_<variable>[_scanID_<n>].nc
+    name = os.path.splitext( os.path.basename(InFile) )[0].split('_', 1)[1]
+    if '_scanID_' in name:
+        variable, sID = name.split('_scanID_')
+        sID = int( sID.split('_')[0] )
+    else:
+        variable, sID = name, -1
+    invars = Dataset(InFile, 'r')
+    t = nc_time( invars.variables['time'] )
+    r = nc_array( invars.variables['range'][:] )
+    if 'ele' in invars.variables:
+        ele = np.nanmean( nc_array(invars.variables['ele'][:]) )
+    elif variable.startswith('VAD_'):
+        ele = float( variable.split('_')[1] )
+    else:
+        ele = np.nan
+    invars.close()
+    if len(t)==0:
+        tstart, tend = pd.NaT, pd.NaT
+    else:
+        tstart, tend = pd.Timestamp(t.min()), pd.Timestamp(t.max())
+
+    return [InFile, variable, sID, tstart, tend, np.nanmin(r), np.nanmax(r), 
+            ele, mtime]
+
+
+# returns data of product variable (file name part, e.g. 'radial_wind_speed'
+# or 'VAD_75') between tstart and tend (and scan IDs in scanIDs) from all 
+# days; opens only files overlapping the request and reads only the 
+# variables in varlist (all if None) and the requested time slices
+def query_catalog(variable, tstart, tend, scanIDs=None, varlist=None):
+    cat = read_catalog()
+    tstart = pd.Timestamp(tstart)
+    tend = pd.Timestamp(tend)
+    sel = cat[ (cat['variable']==variable) & (cat['tend']>=tstart) \
+            & (cat['tstart']<=tend) ]
+    if scanIDs is not None:
+        sel = sel[ sel['scan_ID'].isin(scanIDs) ]
+    if len(sel)==0:
+        return pd.DataFrame()
+    if cl.SWITCH_NCREAD=='netcdf4':
+        ncreader = open_with_netcdf4
+    else:
+        ncreader = open_existing_nc
+
+    return pd.concat([ ncreader(f, varlist, [tstart, tend], scanIDs) \
+            for f in sel['path'] ]).sort_index()
+
+
+# products computed in this run, kept in memory for later stages: key is 
+# day and product name (file name part, e.g. 'radial_wind_speed' or 
+# 'VAD_75'), value is data frame with time and range as index
+Products = {}
+
+
+# keeps product name (data frame df) of day sDate in memory for this run
+def keep_product(sDate, name, df):
+    Products[(sDate, name)] = df
+
+
+# returns product name of day sDate from memory if computed in this run, 
+# otherwise reads netcdf file InFile; only variables in varlist (netcdf 
+# names, all if None) and times within tlim [start, end]
+def get_product(sDate, name, InFile, varlist=None, tlim=None):
+    if (sDate, name) not in Products:
+        printif('.... reading ' + name + ' from file')
+        if cl.SWITCH_NCREAD=='netcdf4':
+            return open_with_netcdf4(InFile, varlist, tlim)
+        else:
+            return open_existing_nc(InFile, varlist, tlim)
+    df = Products[(sDate, name)]
+    if tlim is not None:
+        t = df.index.get_level_values('time')
+        df = df[ (t>=pd.Timestamp(tlim[0])) & (t<=pd.Timestamp(tlim[1])) ]
+    # same variable names as in netcdf file
+    names = dict( (col, cl.AttDict[col][0]) for col in df if col in cl.AttDict )
+    df = df.rename(columns=names)
+    if varlist is not None:
+        df = df[[ v for v in df if v in varlist ]]
+
+    return df
 
 
 # prints message if output option is set in config file
@@ -1,4 +1,7 @@
+import collections
+import copy
 import datetime as dt
+import hashlib
 import matplotlib
 import platform
 if platform.system=='Windows':
@@ -8,8 +11,11 @@ else:
 
 import matplotlib.pyplot as plt
 import matplotlib.dates as dates
+from matplotlib.image import NonUniformImage
 
+import multiprocessing as mp
 import numpy as np
+import os
 import pandas as pd
 import seaborn as sns
 import pdb
@@ -18,6 +24,7 @@ import pdb
 import config_lidar as cl
 # contains windcube functions
 import windcube_io as wio
+import windcube_tools as wt
 
 
 
@@ -25,6 +32,14 @@ import windcube_io as wio
 sns.set(font_scale=1.3)
 sns.set_style("white")
 
+# pool of plot processes (SWITCH_PLOTPOOL), opened with the first plot job and 
+# kept open for all products, and results of submitted plot jobs
+PlotPool = None
+PlotJobs = []
+# numbers of plots found unchanged (SWITCH_PLOTCACHE) and rendered since the 
+# last report
+PlotCount = {'hit': 0, 'miss': 0}
+
 
 # calculates pivot of pandas data frame, returns also axes limits 
 # and color bar properties
@@ -41,10 +56,7 @@ def prepare_plotting(dfplot, sProp, pp):
         t=np.radians(dfplot.azi)
         # distance from Mace Head (at ground)
         r=[x[1] * np.cos( np.radians( dfplot.ele[0] ) ) for x in dfplot.index]
-        clim1, clim2, z, CBlabel = get_lims(dfplot, sProp)
-        if sProp=='wind':
-            clim1 = clim1 * 10.0
-            clim2 = clim2 * 10.0
+        clim1, clim2, z, CBlabel = get_polar_lims(dfplot, sProp)
         CM='rainbow'
     else:
         # for wind components
@@ -93,69 +105,157 @@ def get_lims(dfplot, sProp):
     return clim1, clim2, z, CBlabel
 
 
+# axes limits and color bar properties of low level scans (no vertical scale 
+# for radial wind)
+def get_polar_lims(dfplot, sProp):
+    clim1, clim2, z, CBlabel = get_lims(dfplot, sProp)
+    if sProp=='wind':
+        clim1 = clim1 * 10.0
+        clim2 = clim2 * 10.0
+
+    return clim1, clim2, z, CBlabel
+
+
+# grids vertical line of sight (elevation >= 89.5) of AllB to a raster of 1 
+# minute and all range gates without pivot (fast mode of plot_ts), discards 
+# background; returns times, altitudes, values (altitude, time), axes limits 
+# and color bar properties, None if there is no vertical line of sight
+def raster_ts(AllB, sProp):
+    vert = AllB[AllB['ele'].values>=89.5]
+    if len(vert)==0:
+        return None
+    zcol = cl.VarDict[sProp]['cols'][cl.VarDict[sProp]['N']]
+    cols = [zcol]
+    if 'confidence_index' in vert and cl.SWITCH_REMOVE_BG:
+        cols.append('confidence_index')
+    grid, t0, step, shape, ranges = wt.grid_arrays(vert, '1T', 'mean', None, cols)
+    ras = grid[zcol].reshape(shape)
+    if 'confidence_index' in cols:
+        ras[ grid['confidence_index'].reshape(shape)<30 ] = np.nan
+    t = ( t0 + np.arange(shape[0]) * step ).view('datetime64[ns]')
+    r = ranges * np.sin( np.radians( vert['ele'].values[0] ) )
+    clim1, clim2, z, CBlabel = get_lims({zcol: ras.T}, sProp)
+
+    return t, r, z, clim1, clim2, CBlabel, 'jet', 1.0
+
+
+# updates raster of vertical line of sight of the day (1 minute, all range 
+# gates, raster file of sProp) with the raw rows of AllB (not rows already 
+# reduced to 1 minute) newer than the last binned row; returns raster, None 
+# without vertical line of sight
+def update_raster_day(AllB, sProp, sDate):
+    zcol = cl.VarDict[sProp]['cols'][cl.VarDict[sProp]['N']]
+    cols = [zcol]
+    if 'confidence_index' in AllB and cl.SWITCH_REMOVE_BG:
+        cols.append('confidence_index')
+    rasterfile = cl.ncInput + zcol + '_raster.npz'
+    vert = AllB['ele'].values>=89.5
+    ras, nnew = wt.update_raster(wio.read_raster(rasterfile), AllB, cols, 
+            pd.Timestamp(sDate).value, 60 * 10**9, 1440, vert)
+    if len(ras['ranges'])==0:
+        return None
+    if 'ele' not in ras:
+        ras['ele'] = AllB['ele'].values[vert][0]
+    if nnew>0:
+        wio.printif('.... ' + str(nnew) + ' new rows in raster')
+        wio.write_raster(rasterfile, ras)
+
+    return ras
+
+
+# updates raster of vertical line of sight of the day with the raw rows of 
+# AllB (update_raster_day), returns raster of the whole day as raster_ts
+def raster_day(AllB, sProp, sDate):
+    ras = update_raster_day(AllB, sProp, sDate)
+    if ras is None:
+        return None
+    zcol = cl.VarDict[sProp]['cols'][cl.VarDict[sProp]['N']]
+    z = wt.raster_mean(ras, zcol)
+    if 'n_confidence_index' in ras and cl.SWITCH_REMOVE_BG:
+        z[ wt.raster_mean(ras, 'confidence_index')<30 ] = np.nan
+    t = ( ras['t0'] + np.arange(z.shape[0]) * ras['step'] ).view('datetime64[ns]')
+    r = ras['ranges'] * np.sin( np.radians( ras['ele'] ) )
+    clim1, clim2, z, CBlabel = get_lims({zcol: z.T}, sProp)
+
+    return t, r, z, clim1, clim2, CBlabel, 'jet', 1.0
+
+
 # plot time series
 def plot_ts(AllB,sProp,sDate,plotprop):
     wio.printif('... plot ts of ' + sProp + ', ' + plotprop[0])
-    # select only vertical line of sight (elevation >= 89.5)
+    # fast mode: raster of vertical line of sight (no pivot), drawn as image,
+    # raster of the day is kept in a file and updated (SWITCH_TSRASTER)
+    fast = plotprop[0]=='dummy' and ('fast' in plotprop or cl.SWITCH_TSRASTER)
+    # image file and title
     if plotprop[0]=='dummy':
-        # reduce time resolution to 30 seconds ('30S') # 1 minute ('1T')
-        AllB = AllB.unstack(level='range').resample('1T').stack(level='range')
-        b1 = AllB[AllB.ele>=89.5]
         name = cl.VarDict[sProp]['cols'][cl.VarDict[sProp]['N']]
         title = cl.VarDict[sProp]['longs'][cl.VarDict[sProp]['N']] \
                 + ' (elevation >= 89.5), on ' + sDate
-        # discard background (low confidence index)
-        if 'confidence_index' in AllB and cl.SWITCH_REMOVE_BG:
-            b = b1[b1.confidence_index>=30]
-            numlim = 50.0
+    elif plotprop[0]=='los':
+        name = cl.VarDict[sProp]['cols'][cl.VarDict[sProp]['N']] \
+                + '_elev' + plotprop[2] + '_az' + plotprop[3] + '_scan'\
+                + plotprop[4]
+        title = cl.VarDict[sProp]['longs'][cl.VarDict[sProp]['N']] + ' ('\
+                + plotprop[2] + ' degrees elevation), on ' + sDate
+    else:
+        name = plotprop[0] + '_' + plotprop[2]
+        title = sProp + ' ' + ' (' + plotprop[0] + ', ' + plotprop[2] \
+                + ' degrees elevation), on ' + sDate
+    imgfile = cl.figOUT + name + '_latest.png'
+    # skip unchanged plot before gridding (SWITCH_PLOTCACHE)
+    key = plot_key(AllB, imgfile, [sProp, sDate, plotprop])
+    if cached_plot(imgfile, key):
+        return
+    # select only vertical line of sight (elevation >= 89.5)
+    if plotprop[0]=='dummy':
+        if fast:
+            if cl.SWITCH_TSRASTER:
+                raster = raster_day(AllB, sProp, sDate)
+            else:
+                raster = raster_ts(AllB, sProp)
+            if raster is None:
+                wio.printif('.... no vertical line of sight')
+                return
+            x, y, z, clim1, clim2, CBlabel, CM, alpha = raster
         else:
-            b = b1
-            numlim = 20.0
+            # reduce time resolution to 30 seconds ('30S') # 1 minute ('1T')
+            AllB = wt.grid_data(AllB, '1T')
+            b1 = AllB[AllB.ele>=89.5]
+            # discard background (low confidence index)
+            if 'confidence_index' in AllB and cl.SWITCH_REMOVE_BG:
+                b = b1[b1.confidence_index>=30]
+                numlim = 50.0
+            else:
+                b = b1
+                numlim = 20.0
     else:
         b = AllB
         numlim = 50.0
-        if plotprop[0]=='los':
-            name = cl.VarDict[sProp]['cols'][cl.VarDict[sProp]['N']] \
-                    + '_elev' + plotprop[2] + '_az' + plotprop[3] + '_scan'\
-                    + plotprop[4]
-            title = cl.VarDict[sProp]['longs'][cl.VarDict[sProp]['N']] + ' ('\
-                    + plotprop[2] + ' degrees elevation), on ' + sDate
-        else:
-            name = plotprop[0] + '_' + plotprop[2]
-            title = sProp + ' ' + ' (' + plotprop[0] + ', ' + plotprop[2] \
-                    + ' degrees elevation), on ' + sDate
 
-    # separate time and range index arrays
-    bpivot, t, r, z, clim1, clim2, CBlabel, CM, alpha = prepare_plotting(b, sProp, plotprop)
+    if not fast:
+        # separate time and range index arrays
+        bpivot, t, r, z, clim1, clim2, CBlabel, CM, alpha = prepare_plotting(b, sProp, plotprop)
+        x = bpivot.index.values
+        y = bpivot.columns.values
+        z = bpivot.values.T
 
+    # colors of values out of color bar limits
+    over = None
+    under = None
     if cl.SWITCH_ZOOM and (sProp=='cnr'):
         limdiff = clim2 - clim1
         clim2 = clim1 + limdiff/10.0
         clim1 = clim1 - limdiff/10.0
         wio.printif('.... zooming in')
         wio.printif([clim1, clim2])
-            
-    # plotting
-    plt.figure(figsize=(10, 5))
-    plotarr = np.ma.masked_invalid(bpivot.values.T)
-    cp =  plt.pcolormesh(bpivot.index.values, bpivot.columns.values, 
-            plotarr, cmap=CM, edgecolors='none',
-            vmin=clim1, vmax=clim2, alpha=alpha
-            )
-    cp.cmap.set_bad('white')
-
-    if cl.SWITCH_ZOOM and (sProp=='cnr'):
-        cp.cmap.set_over('grey')
-
+        over = 'grey'
     if plotprop[0]=='wspeed':
-        cp.cmap.set_over('indigo')
+        over = 'indigo'
     elif plotprop[0]=='w':
-        cp.cmap.set_under('navy')
-        cp.cmap.set_over('brown')
-    cp.set_clim(clim1, clim2)
-    cb = plt.colorbar(cp, extend='both')
-    cb.set_label(CBlabel)
-    # set axes limits and format
+        under = 'navy'
+        over = 'brown'
+
+    # set axes limits
     # times
     h1 = int( cl.xlim[0][0:2] )
     m1 = int( cl.xlim[0][2:4] )
@@ -163,80 +263,249 @@ def plot_ts(AllB,sProp,sDate,plotprop):
     h2 = int( cl.xlim[1][0:2] )
     m2 = int( cl.xlim[1][2:4] )
     s2 = int( cl.xlim[1][4:6] )
-    StartTime = bpivot.index[0].replace(hour=h1).replace(minute=m1).replace(second=s1)
-    EndTime = bpivot.index[0].replace(hour=h2).replace(minute=m2).replace(second=s2)
-    plt.xlim( [StartTime, EndTime] )
-    ax=plt.gca()
+    StartTime = pd.Timestamp(x[0]).replace(hour=h1).replace(minute=m1).replace(second=s1)
+    EndTime = pd.Timestamp(x[0]).replace(hour=h2).replace(minute=m2).replace(second=s2)
     if m2>0:
         hend = h2+1
     else:
         hend = h2
-    if hend-h1>=6:
-        ax.xaxis.set_major_locator(dates.HourLocator(byhour=range(h1,hend,(hend-h1)/6)))
-    else:
-        ax.xaxis.set_major_locator(dates.AutoDateLocator())
-    ax.xaxis.set_major_formatter(dates.DateFormatter('%H:%M'))
-    plt.xlabel('time / UTC')
     # range
     if plotprop[0]=='dummy':
-        plt.ylim( cl.TSylim )
+        ylim = cl.TSylim
     elif plotprop[0]=='los' and plotprop[2]<>'90':
         if int(plotprop[4]) in cl.LOSzoom:
-            plt.ylim(cl.LOSzoom[ int(plotprop[4]) ])
+            ylim = cl.LOSzoom[ int(plotprop[4]) ]
         else:
-            plt.ylim([0,bpivot.columns[-1] * np.cos( np.radians( b.ele[0] ) )])
+            ylim = [0,y[-1] * np.cos( np.radians( b.ele[0] ) )]
     elif plotprop[0]=='los' and plotprop[2]=='90':
-        plt.ylim( cl.TSylim )
+        ylim = cl.TSylim
+    else:
+        ylim = cl.VADylim
+
+    # plot job with the gridded data only
+    submit_plot( {'kind': 'ts', 'image': fast,
+        'x': x, 'y': y, 'z': z.astype(np.float32),
+        'cmap': CM, 'clim': [clim1, clim2], 'alpha': alpha,
+        'over': over, 'under': under, 'cblabel': CBlabel,
+        'xlim': [StartTime, EndTime], 'hours': [h1, hend], 'ylim': ylim,
+        'title': title, 'key': key, 'file': imgfile} )
+
+
+# draws time series plot job (see plot_ts)
+def render_ts(job):
+    clim1, clim2 = job['clim']
+    CM = copy.copy( plt.get_cmap(job['cmap']) )
+    plt.figure(figsize=(10, 5))
+    plotarr = np.ma.masked_invalid(job['z'])
+    if job['image']:
+        cp = draw_raster(job['x'], job['y'], plotarr, CM, clim1, clim2, 
+                job['alpha'])
+    else:
+        cp =  plt.pcolormesh(job['x'], job['y'], 
+                plotarr, cmap=CM, edgecolors='none',
+                vmin=clim1, vmax=clim2, alpha=job['alpha']
+                )
+    cp.cmap.set_bad('white')
+    if job['over'] is not None:
+        cp.cmap.set_over(job['over'])
+    if job['under'] is not None:
+        cp.cmap.set_under(job['under'])
+    cp.set_clim(clim1, clim2)
+    cb = plt.colorbar(cp, extend='both')
+    cb.set_label(job['cblabel'])
+    # set axes limits and format
+    # times
+    plt.xlim( job['xlim'] )
+    ax=plt.gca()
+    h1, hend = job['hours']
+    if hend-h1>=6:
+        ax.xaxis.set_major_locator(dates.HourLocator(byhour=range(h1,hend,(hend-h1)/6)))
     else:
-        plt.ylim( cl.VADylim )
+        ax.xaxis.set_major_locator(dates.AutoDateLocator())
+    ax.xaxis.set_major_formatter(dates.DateFormatter('%H:%M'))
+    plt.xlabel('time / UTC')
+    # range
+    plt.ylim( job['ylim'] )
     plt.ylabel('altitude agl / m')
-    plt.title(title)
+    plt.title(job['title'])
     plt.tight_layout()
     plt.grid(b=False)
     # save and close plot
-    plt.savefig(cl.figOUT + name + '_latest.png', dpi=150)
+    plt.savefig(job['file'], dpi=150)
     plt.close()
 
 
-# plots low level scan on polar grid
-def plot_low_scan(toplot, sProp, sDate):
+# draws raster (altitude, time) of regular times t as image, each cell from 
+# its time and altitude to the next (as pcolormesh), returns image
+def draw_raster(t, r, plotarr, CM, clim1, clim2, alpha):
+    ax = plt.gca()
+    x = dates.date2num( pd.to_datetime(t).to_pydatetime() )
+    if len(x)>1:
+        dx = x[1] - x[0]
+    else:
+        dx = 1.0 / 1440
+    if len(r)>1:
+        dr = np.diff(r)
+    else:
+        dr = np.array([1.0])
+    extent = [ x[0], x[-1] + dx, r[0], r[-1] + dr[-1] ]
+    if np.allclose(dr, dr[0]):
+        cp = plt.imshow(plotarr, cmap=CM, vmin=clim1, vmax=clim2, 
+                alpha=alpha, aspect='auto', origin='lower', 
+                interpolation='nearest', extent=extent)
+    else:
+        # range gates of different length
+        cp = NonUniformImage(ax, cmap=CM, interpolation='nearest', 
+                extent=extent)
+        cp.set_data(x + dx / 2, r + np.append(dr, dr[-1]) / 2, plotarr)
+        cp.set_clim(clim1, clim2)
+        cp.set_alpha(alpha)
+        ax.images.append(cp)
+        ax.set_xlim(extent[0:2])
+        ax.set_ylim(extent[2:4])
+    ax.xaxis_date()
+
+    return cp
+
+
+# plots low level scans on polar grid (start and stop row of each scan from 
+# scan index, separated by ScanGap if not given)
+def plot_low_scan(toplot, sProp, sDate, starts=None, stops=None):
     if len(toplot.scan_ID)>0:
-        # time difference of 59 seconds (in ns)
-        newscan=np.where(np.diff(toplot.index.get_level_values('time')).astype(float) > 59000000000)
-        n=0
-        for s in newscan[0]:
-            fig=plt.figure(figsize=(6, 5))
+        if starts is None:
+            starts, stops = wt.scan_limits(toplot)
+        for n, s in zip(starts, stops):
             # plot horizontal scan from n to s
-            thisscan=toplot[n:s]
-            sTitle = 'scan on ' + thisscan.index[0][0].strftime('%Y/%m/%d')\
-                    + ' from ' + thisscan.index[0][0].strftime('%H:%M:%S')\
-                    + ' to ' + thisscan.index[-1][0].strftime('%H:%M:%S')
-            bpivot, a, r, z, clim1, clim2, CBlabel, CM, alpha = prepare_plotting(thisscan, sProp, ['low_scan'])
-
-            bpivotsmooth=np.zeros(np.shape(bpivot))
-            window_size=5
-            window = np.ones(int(window_size))/float(window_size)
-
-            # plotting
-            ax = plt.subplot(111, polar=True)
-            plt.title( sTitle )
-            cp = plt.contourf(bpivot.index, bpivot.columns, bpivot.T, cmap=CM,
-                    vmin=clim1, vmax=clim2, alpha=alpha,
-                    levels=np.arange(clim1, clim2, (clim2-clim1)/50.0)
-                    )
-            cb = plt.colorbar(cp)
-            cb.set_label(CBlabel)
-            ax.set_theta_zero_location('N')
-            ax.set_theta_direction(-1)
-            plt.tight_layout()
-            plt.grid(b=True, which='both')
-            # save plot
-            plt.savefig(cl.figOUT + sDate + '_' \
-                    + cl.VarDict[sProp]['cols'][cl.VarDict[sProp]['N']] \
-                    + '_elev_' + str( int( round(toplot.ele[0]) ) ) + '_' \
-                    + str(n) + '_low_scan.png', dpi=150)
-            plt.close()
-            n=s
+            plot_polar(toplot[n:s], sProp, sDate, n)
+
+
+# plots one low level scan on polar grid, n is position of scan in data of day
+def plot_polar(thisscan, sProp, sDate, n):
+    sTitle = 'scan on ' + thisscan.index[0][0].strftime('%Y/%m/%d')\
+            + ' from ' + thisscan.index[0][0].strftime('%H:%M:%S')\
+            + ' to ' + thisscan.index[-1][0].strftime('%H:%M:%S')
+    imgfile = cl.figOUT + sDate + '_' \
+            + cl.VarDict[sProp]['cols'][cl.VarDict[sProp]['N']] \
+            + '_elev_' + str( int( round(thisscan.ele[0]) ) ) + '_' \
+            + str(n) + '_low_scan.png'
+    # skip unchanged plot before gridding (SWITCH_PLOTCACHE)
+    key = plot_key(thisscan, imgfile, [sProp, sDate, n])
+    if cached_plot(imgfile, key):
+        return
+    if cl.SWITCH_POLAR=='mesh':
+        x, y, z, clim1, clim2, CBlabel = raster_polar(thisscan, sProp)
+        CM = 'rainbow'
+        alpha = 1.0
+    else:
+        bpivot, a, r, z, clim1, clim2, CBlabel, CM, alpha = prepare_plotting(thisscan, sProp, ['low_scan'])
+        x = bpivot.index.values
+        y = bpivot.columns.values
+        z = bpivot.values.T
+
+    # plot job with the gridded data only
+    submit_plot( {'kind': 'polar', 'mesh': cl.SWITCH_POLAR=='mesh',
+        'x': x, 'y': y, 'z': z.astype(np.float32),
+        'cmap': CM, 'clim': [clim1, clim2], 'alpha': alpha,
+        'cblabel': CBlabel, 'title': sTitle, 'key': key, 'file': imgfile} )
+
+
+# grids one low level scan to a regular azimuth grid (nominal azimuth step of 
+# the scan) and its range gates without pivot (SWITCH_POLAR 'mesh'), returns 
+# cell edges of azimuth (radians) and ground distance (see polar_mesh), 
+# values (range, azimuth), axes limits and color bar properties
+def raster_polar(thisscan, sProp):
+    clim1, clim2, z, CBlabel = get_polar_lims(thisscan, sProp)
+    azi = thisscan['azi'].values.astype(np.float64)
+    ranges, rix = np.unique( thisscan.index.get_level_values('range').values, 
+            return_inverse=True )
+    # nominal azimuth step (0.1 degrees resolution) and position of each row 
+    # on the azimuth grid
+    azis = np.unique(azi)
+    if len(azis)>1:
+        step = max( round( np.median( np.diff(azis) ), 1 ), 0.1 )
+    else:
+        step = 1.0
+    aq = np.round( azi / step ).astype(np.int64)
+    a0 = aq.min()
+    naz = aq.max() - a0 + 1
+    aix = aq - a0
+    aedges, dedges = polar_mesh( thisscan['scan_ID'].values[0], 
+            thisscan['ele'].values[0], step, a0, naz, ranges )
+    # mean of rows in same cell of azimuth grid and range gate
+    v = np.asarray(z, dtype=np.float64)
+    ok = np.isfinite(v)
+    cell = rix[ok] * naz + aix[ok]
+    cnt = np.bincount( cell, minlength=len(ranges)*naz )
+    tot = np.bincount( cell, v[ok], minlength=len(ranges)*naz )
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ras = np.where( cnt>0, tot / cnt, np.nan )
+
+    return aedges, dedges, ras.reshape(len(ranges), naz), \
+            clim1, clim2, CBlabel
+
+
+# meshes of polar plots by scan geometry (see polar_mesh), oldest mesh is 
+# removed if there are more than PolarMeshMax
+PolarMesh = collections.OrderedDict()
+PolarMeshMax = 20
+
+
+# returns cell edges of azimuth (radians) and ground distance of polar plot 
+# for scan geometry (scan ID, elevation, azimuth grid of naz steps of step 
+# degrees from a0 steps, ranges), computed once and reused for all scans and 
+# variables of the same geometry
+def polar_mesh(sID, ele, step, a0, naz, ranges):
+    ranges = np.round(ranges, 1)
+    key = ( int(sID), round(ele, 1), step, int(a0), int(naz), 
+            ranges.tostring() )
+    if key not in PolarMesh:
+        if len(PolarMesh)>=PolarMeshMax:
+            PolarMesh.popitem(last=False)
+        aedges = np.radians( (a0 - 0.5 + np.arange(naz + 1)) * step )
+        # distance from Mace Head (at ground)
+        PolarMesh[key] = ( aedges, 
+                cell_edges( ranges * np.cos( np.radians(ele) ) ) )
+
+    return PolarMesh[key]
+
+
+# returns edges of cells centered at sorted positions x (half way between 
+# neighbours, half a step beyond the first and last position)
+def cell_edges(x):
+    if len(x)<2:
+        return np.concatenate([ x - 0.5, x + 0.5 ])
+    mid = ( x[1:] + x[:-1] ) / 2.0
+    return np.concatenate([ [x[0] - (mid[0] - x[0])], mid, 
+        [x[-1] + (x[-1] - mid[-1])] ])
+
+
+# draws polar plot job (see plot_polar)
+def render_polar(job):
+    clim1, clim2 = job['clim']
+    fig=plt.figure(figsize=(6, 5))
+    # plotting
+    ax = plt.subplot(111, polar=True)
+    plt.title( job['title'] )
+    if job['mesh']:
+        CM = copy.copy( plt.get_cmap(job['cmap']) )
+        cp = plt.pcolormesh(job['x'], job['y'], np.ma.masked_invalid(job['z']), 
+                cmap=CM, edgecolors='none', vmin=clim1, vmax=clim2, 
+                alpha=job['alpha'])
+        cp.cmap.set_bad('white', alpha=0)
+    else:
+        cp = plt.contourf(job['x'], job['y'], job['z'], cmap=job['cmap'],
+                vmin=clim1, vmax=clim2, alpha=job['alpha'],
+                levels=np.arange(clim1, clim2, (clim2-clim1)/50.0)
+                )
+    cb = plt.colorbar(cp)
+    cb.set_label(job['cblabel'])
+    ax.set_theta_zero_location('N')
+    ax.set_theta_direction(-1)
+    plt.tight_layout()
+    plt.grid(b=True, which='both')
+    # save plot
+    plt.savefig(job['file'], dpi=150)
+    plt.close()
 
 
 # plots LOS as time series
@@ -248,6 +517,96 @@ def plot_los(toplot, sProp, sDate):
         plot_ts(toplot,sProp,sDate,['los', '', elestr, azstr, scanstr])
 
 
+# draws plot job in this process, saves key of plot job next to image
+def render_plot(job):
+    if job['kind']=='ts':
+        render_ts(job)
+    elif job['kind']=='polar':
+        render_polar(job)
+    if job['key'] is not None:
+        with open(job['file'] + '.md5', 'w') as f:
+            f.write(job['key'])
+
+
+# settings of config_lidar changing the plots (see plot_key)
+PlotSettings = ['SWITCH_REMOVE_BG', 'SWITCH_ZOOM', 'SWITCH_TSRASTER', 
+        'SWITCH_POLAR', 'xlim', 'TSylim', 'LOSzoom', 'VADylim']
+
+
+# returns md5 key of plot input (raw data frame df before gridding, plot 
+# parameters, variable properties of sProp and PlotSettings of config_lidar) 
+# for image file imgfile, None without plot cache (SWITCH_PLOTCACHE)
+def plot_key(df, imgfile, params):
+    if not cl.SWITCH_PLOTCACHE:
+        return None
+    md5 = hashlib.md5()
+    md5.update( imgfile + repr(params) + repr(cl.VarDict[params[0]]) )
+    md5.update( repr([ getattr(cl, s) for s in PlotSettings ]) )
+    for v in [ df.index.get_level_values(l).values for l in df.index.names ] \
+            + [ df[col].values for col in df.columns ]:
+        if v.dtype==object:
+            md5.update( repr( v.tolist() ) )
+        else:
+            md5.update( str(v.dtype) + str(v.shape) )
+            md5.update( np.ascontiguousarray(v).tostring() )
+
+    return md5.hexdigest()
+
+
+# checks if image file imgfile exists and was saved with the same key, counts 
+# unchanged (hit) and rendered (miss) plots
+def cached_plot(imgfile, key):
+    if key is None:
+        return False
+    keyfile = imgfile + '.md5'
+    hit = False
+    if os.path.exists(imgfile) and os.path.exists(keyfile):
+        with open(keyfile) as f:
+            hit = f.read()==key
+    if hit:
+        PlotCount['hit'] += 1
+    else:
+        PlotCount['miss'] += 1
+
+    return hit
+
+
+# renders plot job in pool of plot processes (SWITCH_PLOTPOOL), or at once if 
+# no pool is used; unchanged plots are skipped before (plot_key, cached_plot)
+def submit_plot(job):
+    global PlotPool
+    if cl.SWITCH_PLOTPOOL>0:
+        if PlotPool is None:
+            wio.printif( '.... open plot pool ' )
+            PlotPool = mp.Pool(processes=cl.SWITCH_PLOTPOOL)
+        PlotJobs.append( PlotPool.apply_async(render_plot, args=(job,)) )
+    else:
+        render_plot(job)
+
+
+# waits until all submitted plot jobs are rendered, reports plot cache
+def wait_plots():
+    # raise errors of workers
+    [ res.get() for res in PlotJobs ]
+    del PlotJobs[:]
+    if cl.SWITCH_PLOTCACHE and (PlotCount['hit'] + PlotCount['miss'])>0:
+        wio.printif( '.... plot cache: ' + str(PlotCount['hit']) \
+                + ' unchanged, ' + str(PlotCount['miss']) + ' rendered' )
+        PlotCount['hit'] = 0
+        PlotCount['miss'] = 0
+
+
+# waits for submitted plot jobs and closes pool of plot processes
+def close_plot_pool():
+    global PlotPool
+    wait_plots()
+    if PlotPool is not None:
+        wio.printif( '.... close plot pool ' )
+        PlotPool.close()
+        PlotPool.join()
+        PlotPool = None
+
+
 # plot correlations
 def plot_correlation(df, p, sDate, xName, yName, sTitle, titleadd, dims):
     # set nan all outliers (out of plotting domain given by "dims")
@@ -1,5 +1,9 @@
 import datetime as dt
+import hashlib
+import os
+import tempfile
 import time
+import warnings
 
 import numpy as np
 from scipy import optimize
@@ -14,21 +18,338 @@ import windcube_plotting as wp
 
 
 
-# changes single LOS scan IDs of VAD composites to one ID
+# changes single LOS scan IDs of VAD composites to one ID (one pass with 
+# lookup table, scan_ID column is replaced in place)
 def change_scan_IDs(df):
-    df['new_scan_ID'] = df['scan_ID'].copy()
+    df['scan_ID'] = composite_scan_IDs( df['scan_ID'].values )
+
+    return df
+
+
+# returns array of scan IDs with single LOS scan IDs of VAD composites
+# replaced by the composite ID (array version of change_scan_IDs)
+def composite_scan_IDs(sID):
+    if len(sID)==0 or sID.dtype.kind not in 'iu' or sID.min()<0:
+        # scan IDs not usable as table positions (e.g. float from netcdf)
+        newID = sID.copy()
+        for cScan in cl.ScanID['COM']:
+            newID[np.in1d( sID, cl.CompDict[cScan] )] = cScan
+        return newID
+    # lookup table: composite ID at position of each single LOS scan ID
+    table = np.arange( sID.max() + 1, dtype=sID.dtype )
     for cScan in cl.ScanID['COM']:
-        df.loc[df['scan_ID'].isin( cl.CompDict[cScan] ), 'new_scan_ID'] = cScan
+        single = [ i for i in cl.CompDict[cScan] if i<len(table) ]
+        table[single] = cScan
 
-    df.drop(['scan_ID'], axis=1, inplace=True)
-    df.rename(columns={'new_scan_ID':'scan_ID'}, inplace=True)
+    return table[sID]
 
-    return df
+
+# builds index of the scans of data frame df (after change_scan_IDs), a scan
+# ends where the scan ID changes or after a time gap of ScanGap seconds; 
+# returns data frame with one row per scan: first and last + 1 row (start, 
+# stop), scan_ID, elevation, azimuth span (azimin, azimax), time of first 
+# and last row (tstart, tend) and number of range gates
+def scan_index(df):
+    clms = [ 'start', 'stop', 'scan_ID', 'ele', 'azimin', 'azimax', 
+            'tstart', 'tend', 'ngates' ]
+    if len(df)==0:
+        return pd.DataFrame(columns=clms)
+    t = df.index.get_level_values('time').values
+    sID = df['scan_ID'].values
+    newscan = (np.diff(t) > np.timedelta64(cl.ScanGap, 's')) \
+            | (np.diff(sID)<>0)
+    starts = np.concatenate([ [0], np.where(newscan)[0] + 1 ])
+    stops = np.concatenate([ starts[1:], [len(t)] ])
+    # number of time stamps per scan
+    tnew = np.concatenate([ [True], t[1:]<>t[:-1] ])
+    tnew[starts] = True
+    ntimes = np.add.reduceat( tnew.astype(int), starts )
+    azi = df['azi'].values
+    six = pd.DataFrame( {
+        'start'  : starts,
+        'stop'   : stops,
+        'scan_ID': sID[starts],
+        'ele'    : df['ele'].values[starts],
+        'azimin' : np.minimum.reduceat( azi, starts ),
+        'azimax' : np.maximum.reduceat( azi, starts ),
+        'tstart' : t[starts],
+        'tend'   : t[stops - 1],
+        'ngates' : (stops - starts) // np.maximum(ntimes, 1),
+        }, columns=clms )
+
+    return six
+
+
+# returns rows of data frame df of all scans with ID sID (from scan index 
+# six), start and stop row of each scan within the returned rows
+def scan_rows(df, six, sID):
+    sel = six[six['scan_ID']==sID]
+    rows, starts, stops = scan_positions( sel['start'].values, 
+            sel['stop'].values )
+
+    return df.iloc[rows], starts, stops
+
+
+# returns positions of the rows from start to stop (arrays) of each scan, 
+# start and stop of each scan within these rows
+def scan_positions(start, stop):
+    n = stop - start
+    stops = np.cumsum(n)
+    starts = stops - n
+    rows = np.arange( n.sum() ) + np.repeat( start - starts, n )
+
+    return rows, starts, stops
+
+
+# bins long format data frame df (index time and range) to a regular grid of 
+# time steps freq (e.g. '1T') and all ranges of df; reduction how of the 
+# values of each bin: 'mean', 'count', 'first' (first in time) or 'nearest' 
+# (closest to start of bin); empty bins are filled with the next bin in time 
+# if fill is 'bfill'; only numeric columns are binned (cols, all if None); 
+# returns long format data frame with start of bin and range as index, 
+# without rows where all values are NaN (as unstack/resample/stack)
+def grid_data(df, freq, how='mean', fill=None, cols=None):
+    if cols is None:
+        cols = [ c for c in df if df[c].dtype.kind in 'biuf' ]
+    if len(df)==0:
+        return pd.DataFrame( columns=cols )
+    grid, t0, step, shape, ranges = grid_arrays(df, freq, how, fill, cols)
+
+    return grid_frame(grid, t0, step, shape, ranges, cols)
+
+
+# bins df as grid_data, returns raster (dictionary of flat arrays (time, 
+# range) per column), first time step t0 and step (ns), shape and ranges
+def grid_arrays(df, freq, how, fill, cols):
+    step = pd.tseries.frequencies.to_offset(freq).nanos
+    tn = df.index.get_level_values('time').values.view(np.int64)
+    ranges, rbin = np.unique( df.index.get_level_values('range').values, 
+            return_inverse=True )
+    t0 = tn.min() // step * step
+    tbin = (tn - t0) // step
+    shape = ( tbin.max() + 1, len(ranges) )
+    cell = tbin * shape[1] + rbin
+    grid = {}
+    for col in cols:
+        v = df[col].values.astype(np.float64)
+        ok = np.isfinite(v)
+        if how=='mean' or how=='count':
+            n = np.bincount( cell[ok], minlength=shape[0]*shape[1] )
+            if how=='count':
+                g = n.astype(np.float64)
+            else:
+                s = np.bincount( cell[ok], v[ok], minlength=shape[0]*shape[1] )
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    g = np.where( n>0, s / n, np.nan )
+        else:
+            # order values by bin, then by time (first) or by distance to 
+            # start of bin (nearest), take first value of each bin
+            if how=='first':
+                key = tn[ok]
+            else:
+                key = tn[ok] - t0 - tbin[ok] * step
+            order = np.lexsort( (key, cell[ok]) )
+            c = cell[ok][order]
+            isfirst = np.concatenate([ [True], c[1:]<>c[:-1] ])
+            g = np.empty( shape[0]*shape[1] )
+            g.fill(np.nan)
+            g[ c[isfirst] ] = v[ok][order][isfirst]
+        g = g.reshape(shape)
+        if fill=='bfill':
+            g = bfill_grid(g)
+        grid[col] = g.reshape(-1)
+
+    return grid, t0, step, shape, ranges
+
+
+# builds long format data frame from grid (dictionary of flat arrays (time, 
+# range) per column) with time steps step (ns) from t0 and ranges, without 
+# rows where all values are NaN
+def grid_frame(grid, t0, step, shape, ranges, cols):
+    times = (t0 + np.arange(shape[0]) * step).view('datetime64[ns]')
+    gridindex = pd.MultiIndex.from_product( [times, ranges], 
+            names=['time', 'range'] )
+    griddf = pd.DataFrame( grid, index=gridindex, columns=cols )
+
+    return griddf.dropna( how='all' )
+
+
+# averages long format data frame df (index time and range) in time bins of 
+# several lengths (levels, in minutes, multiples of the first level); sums 
+# and counts of the numeric columns (cols, all if None) are binned once at 
+# the first level, coarser levels are summed up from them; bins start at 
+# full multiples of their length (as resample); empty bins are filled with 
+# the next bin in time if fill is 'bfill'; returns dictionary of level and 
+# data frame of means (as grid_data)
+def grid_pyramid(df, levels, cols=None, fill=None):
+    if cols is None:
+        cols = [ c for c in df if df[c].dtype.kind in 'biuf' ]
+    step = levels[0] * 60 * 10**9
+    tn = df.index.get_level_values('time').values.view(np.int64)
+    ranges, rbin = np.unique( df.index.get_level_values('range').values, 
+            return_inverse=True )
+    if len(tn)==0:
+        return dict( (level, pd.DataFrame(columns=cols)) for level in levels )
+    # first bin at start of day, coarser bins are aligned to full minutes
+    day = 24 * 3600 * 10**9
+    t0 = tn.min() // day * day
+    tbin = (tn - t0) // step
+    # number of first level bins covering the last bin of each level
+    nt = max([ (tbin.max() // (level // levels[0]) + 1) * (level // levels[0]) \
+            for level in levels ])
+    cell = tbin * len(ranges) + rbin
+    sums = {}
+    counts = {}
+    for col in cols:
+        v = df[col].values.astype(np.float64)
+        ok = np.isfinite(v)
+        sums[col] = np.bincount( cell[ok], v[ok], 
+                minlength=nt*len(ranges) ).reshape(nt, len(ranges))
+        counts[col] = np.bincount( cell[ok], 
+                minlength=nt*len(ranges) ).reshape(nt, len(ranges))
+    pyramid = {}
+    for level in levels:
+        k = level // levels[0]
+        # bins of level start with the bin of the first time
+        first = tbin.min() // k
+        shape = ( tbin.max() // k + 1 - first, len(ranges) )
+        sl = slice( first * k, (first + shape[0]) * k )
+        grid = {}
+        for col in cols:
+            s = sums[col][sl].reshape(shape[0], k, shape[1]).sum(axis=1)
+            n = counts[col][sl].reshape(shape[0], k, shape[1]).sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                g = np.where( n>0, s / n, np.nan )
+            if fill=='bfill':
+                g = bfill_grid(g)
+            grid[col] = g.reshape(-1)
+        pyramid[level] = grid_frame(grid, t0 + first * step * k, step * k, 
+                shape, ranges, cols)
+
+    return pyramid
+
+
+# joins columns cols of data frame right to the rows of data frame left 
+# (both index time and range): value of right at the same range and the 
+# latest time not after the time of left, not older than tolerance 
+# (timedelta64), NaN if there is none; returns left with the joined columns
+def asof_join(left, right, cols, tolerance):
+    lt = left.index.get_level_values('time').values.view(np.int64)
+    rt = right.index.get_level_values('time').values.view(np.int64)
+    lr = left.index.get_level_values('range').values
+    rr = right.index.get_level_values('range').values
+    joined = left.copy()
+    for col in cols:
+        joined[col] = np.nan
+    if len(lt)==0 or len(rt)==0:
+        return joined
+    # sort key of right: range first, then time
+    ranges = np.union1d(lr, rr)
+    lri = np.searchsorted(ranges, lr)
+    rri = np.searchsorted(ranges, rr)
+    tmin = min( lt.min(), rt.min() )
+    span = max( lt.max(), rt.max() ) - tmin + 1
+    rkey = rri * span + (rt - tmin)
+    order = np.argsort(rkey, kind='mergesort')
+    pos = np.searchsorted( rkey[order], lri * span + (lt - tmin), 
+            side='right' ) - 1
+    ok = pos>=0
+    pos = order[ np.where(ok, pos, 0) ]
+    ok = ok & (rri[pos]==lri) \
+            & (lt - rt[pos] <= tolerance.astype('timedelta64[ns]').astype(np.int64))
+    for col in cols:
+        vals = right[col].values.astype(np.float64)
+        joined[col] = np.where( ok, vals[pos], np.nan )
+
+    return joined
 
 
-def run_fit(wrbin, az, ele, sProp, rbin):
-    clms = ['wspeed', 'w', 'wdir', 'number_of_function_calls', 'rsquared']
-    ws_out = pd.DataFrame( columns=clms, index=[rbin], dtype='float64' )
+# fills NaN of grid (time, range) with next valid value in time
+def bfill_grid(g):
+    valid = np.isfinite(g)
+    ix = np.where( valid, np.arange(g.shape[0])[:, np.newaxis], g.shape[0] )
+    # position of next valid value (from the end)
+    ix = np.minimum.accumulate( ix[::-1], axis=0 )[::-1]
+    filled = np.vstack([ g, np.nan * np.ones((1, g.shape[1])) ])
+
+    return filled[ ix, np.arange(g.shape[1]) ]
+
+
+# bins rows of long format data frame df (index time and range) selected by 
+# sel (boolean array, all rows if None) and newer than the last binned row 
+# into raster ras of the day (dictionary of sums and counts (time, range) of 
+# cols in nt time steps of step (ns) from t0, ranges and time of last row); 
+# only the time steps of new rows are changed; the raster is built anew from 
+# all selected rows if it is empty or doesn't match (other ranges, columns or 
+# day); 'last' is the time of the last raw row binned, not the start of its 
+# time step, so df has to hold raw rows (not rows already reduced to time 
+# steps); returns raster and number of new rows
+def update_raster(ras, df, cols, t0, step, nt, sel=None):
+    tn = df.index.get_level_values('time').values.view(np.int64)
+    r = df.index.get_level_values('range').values
+    if sel is None:
+        sel = np.ones(len(df), dtype=bool)
+    if ras and int(ras['t0'])==t0 and int(ras['step'])==step \
+            and all([ 'sum_' + col in ras for col in cols ]):
+        new = sel & (tn > ras['last'])
+        rbin = np.searchsorted( ras['ranges'], r[new] )
+        rbin = np.minimum( rbin, len(ras['ranges']) - 1 )
+        if not np.all( ras['ranges'][rbin]==r[new] ):
+            # new range gates
+            ras = {}
+    else:
+        ras = {}
+    if not ras:
+        new = sel
+        ranges, rbin = np.unique( r[new], return_inverse=True )
+        ras = {'t0': t0, 'step': step, 'ranges': ranges, 'last': t0 - 1}
+        for col in cols:
+            ras['sum_' + col] = np.zeros( (nt, len(ranges)) )
+            ras['n_' + col] = np.zeros( (nt, len(ranges)), dtype=np.int32 )
+    if not np.any(new):
+        return ras, 0
+    nr = len(ras['ranges'])
+    tbin = (tn[new] - t0) // step
+    inday = (tbin>=0) & (tbin<nt)
+    ras['last'] = max( int(ras['last']), tn[new].max() )
+    tbin = tbin[inday]
+    rbin = rbin[inday]
+    if len(tbin)==0:
+        return ras, 0
+    # time steps of new rows only
+    lo = tbin.min()
+    hi = tbin.max() + 1
+    cell = (tbin - lo) * nr + rbin
+    for col in cols:
+        v = df[col].values[new][inday].astype(np.float64)
+        ok = np.isfinite(v)
+        ras['sum_' + col][lo:hi] += np.bincount( cell[ok], v[ok], 
+                minlength=(hi-lo)*nr ).reshape(hi-lo, nr)
+        ras['n_' + col][lo:hi] += np.bincount( cell[ok], 
+                minlength=(hi-lo)*nr ).reshape(hi-lo, nr).astype(np.int32)
+
+    return ras, len(tbin)
+
+
+# returns means of column col of raster ras (time, range), NaN without data
+def raster_mean(ras, col):
+    n = ras['n_' + col]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where( n>0, ras['sum_' + col] / n, np.nan )
+
+
+# pool of processes for VAD fit, opened on first use (open_pool) and reused 
+# by all calls of wind_fit until close_pool
+FitPool = None
+
+
+# columns of fit results (last axis of result arrays of fit_scan)
+FitCols = ['wspeed', 'w', 'wdir', 'number_of_function_calls', 'rsquared']
+
+
+# fits sine function to radial wind wrbin at azimuth az and elevation ele 
+# (degrees) of one range gate, writes results (order of FitCols) to array res
+def run_fit(wrbin, az, ele, res):
     # Target function
     fitfunc = lambda p, x: p[0]+p[1]*np.cos(x-p[2])
     # p[0] ... a (offset)
@@ -40,12 +361,12 @@ def run_fit(wrbin, az, ele, sProp, rbin):
     errfunc = lambda p, x, y: fitfunc(p, x) - y
     # set azimuth to range from 0 to 360 instead of 0 to -0
     theta = np.radians( az[az < max(az)] )
-    elevation = np.radians( ele[0] )
+    elevation = np.radians( ele )
     # fit originally for radial wind positive towards lidar, radial wind 
     # however changed in get_data to positive away from lidar
     # radial wind changed back here to use fit as it is
     radial_wind = wrbin[az < max(az)] * (-1.0)
-#   we.set_outliers_to_nan(radial_wind)
+    # (outliers are removed before, see outliers_to_nan)
     # initial guess
     if radial_wind.any():
         # Initial guess for fit parameters
@@ -74,42 +395,305 @@ def run_fit(wrbin, az, ele, sProp, rbin):
     else:
         rsquared = -999
         nfcalls = -999
-    ws_out['number_of_function_calls'][rbin] = nfcalls
-    ws_out['rsquared'][rbin] = rsquared
+    res[3] = nfcalls
+    res[4] = rsquared
 
     if rsquared>=0.1:
         # wind components
         # horizontal wind
-        ws_out['wspeed'][rbin] = p1[1]/np.cos( elevation )
+        res[0] = p1[1]/np.cos( elevation )
         # vertical wind
-        ws_out['w'][rbin] = -p1[0]/np.sin( elevation )
+        res[1] = -p1[0]/np.sin( elevation )
         # wind direction
-        ws_out['wdir'][rbin] = np.degrees(p1[2])
+        res[2] = np.degrees(p1[2])
     else:
-        ws_out['wspeed'][rbin] = np.nan
-        ws_out['w'][rbin] = np.nan
-        ws_out['wdir'][rbin] = np.nan
+        res[0:3] = np.nan
+
+    return res
+
+
+# batched closed form VAD fit of radial wind vr (scan, azimuth, gate) at 
+# azimuth az (scan, azimuth) and elevation ele (scan), angles in degrees;
+# the model a + b*cos(theta - phi) is linear in (a, b*cos(phi), b*sin(phi)),
+# so all gates of all scans are solved at once by linear least squares 
+# (NaN are ignored, same selection of points as run_fit); niter fits 
+# reweighted with Tukey biweight of the residuals follow the first fit;
+# returns dictionary of arrays (scan, gate): wspeed, w, wdir, rsquared, 
+# residuals (sum of squared residuals), number_of_function_calls
+def vad_linear(vr, az, ele, niter=0):
+    # azimuth of closing beam (maximum) is not used, as in run_fit
+    az = np.where( az < np.nanmax(az, axis=1)[:, np.newaxis], az, np.nan )
+    theta = np.radians(az)[:, :, np.newaxis]
+    # fit for radial wind positive towards lidar, as in run_fit
+    y = vr * (-1.0)
+    valid = np.isfinite(y) & np.isfinite(theta)
+    y = np.where(valid, y, 0.0)
+    cos = np.where(valid, np.cos(theta), 0.0)
+    sin = np.where(valid, np.sin(theta), 0.0)
+    wgt = valid.astype(np.float64)
+    for it in range(0, niter + 1):
+        if it>0:
+            # weights from residuals of last fit, scaled by the median 
+            # absolute residual of scan and gate
+            res = np.where(valid, y - fit, np.nan)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                scale = 4.685 * 1.4826 * np.nanmedian( np.abs(res), axis=1 )
+            scale = np.where( scale>0, scale, np.inf )[:, np.newaxis, :]
+            u = np.where( valid, res / scale, 1.0 )
+            wgt = np.where( np.abs(u)<1, (1 - u**2)**2, 0.0 )
+        p, ok = vad_solve(wgt, y, cos, sin)
+        fit = p[:, np.newaxis, :, 0] + p[:, np.newaxis, :, 1] * cos \
+                + p[:, np.newaxis, :, 2] * sin
+    a = p[..., 0]
+    b = np.hypot( p[..., 1], p[..., 2] )
+    phi = np.arctan2( p[..., 2], p[..., 1] )
+    # (weighted) R^2 and residuals
+    n = wgt.sum(axis=1)
+    ss_err = ( wgt * (y - fit)**2 ).sum(axis=1)
+    ymean = (wgt * y).sum(axis=1) / np.where(ok, n, 1.0)
+    ss_tot = ( wgt * (y - ymean[:, np.newaxis, :])**2 ).sum(axis=1)
+    rsquared = np.where( ok & (ss_tot>0), 
+            1 - ss_err/np.where(ss_tot>0, ss_tot, 1.0), -999 )
+    # wind components of fits with rsquared >= 0.1
+    good = rsquared>=0.1
+    elevation = np.radians(ele)[:, np.newaxis]
+    out = {}
+    out['wspeed'] = np.where( good, b/np.cos(elevation), np.nan )
+    out['w'] = np.where( good, -a/np.sin(elevation), np.nan )
+    out['wdir'] = np.where( good, np.degrees(phi) % 360, np.nan )
+    out['rsquared'] = rsquared
+    out['residuals'] = np.where( ok, ss_err, np.nan )
+    out['number_of_function_calls'] = np.where( ok, niter + 1, -999 )
+
+    return out
+
+
+# solves weighted normal equations of VAD fit of all scans and gates (wgt, y, 
+# cos and sin are arrays (scan, azimuth, gate), zero where not valid); 
+# returns parameters (scan, gate, 3) and mask of gates fitted (scan, gate)
+def vad_solve(wgt, y, cos, sin):
+    wcos = wgt * cos
+    wsin = wgt * sin
+    # normal equations (scan, gate, 3, 3) and right hand side (scan, gate, 3)
+    n = wgt.sum(axis=1)
+    A = np.empty( n.shape + (3, 3) )
+    A[..., 0, 0] = n
+    A[..., 0, 1] = A[..., 1, 0] = wcos.sum(axis=1)
+    A[..., 0, 2] = A[..., 2, 0] = wsin.sum(axis=1)
+    A[..., 1, 1] = (wcos * cos).sum(axis=1)
+    A[..., 1, 2] = A[..., 2, 1] = (wcos * sin).sum(axis=1)
+    A[..., 2, 2] = (wsin * sin).sum(axis=1)
+    rhs = np.empty( n.shape + (3, ) )
+    rhs[..., 0] = (wgt * y).sum(axis=1)
+    rhs[..., 1] = (wcos * y).sum(axis=1)
+    rhs[..., 2] = (wsin * y).sum(axis=1)
+    # gates with too few points or no signal are not fitted
+    ok = ((wgt>0).sum(axis=1)>=3) & (np.abs(wgt * y).sum(axis=1)>0)
+    if ok.any():
+        ok[ok] = np.abs( np.linalg.det(A[ok]) ) > 1e-10
+    A[~ok] = np.eye(3)
+    rhs[~ok] = 0.0
+    p = np.linalg.solve( A, rhs[..., np.newaxis] )[..., 0]
+
+    return p, ok
+
+
+# sets radial wind vr (scan, azimuth, gate) to NaN where its deviation from 
+# the median of scan and gate is larger than margin times the median 
+# deviation (vectorized windcube_extras.set_outliers_to_nan), returns copy
+def outliers_to_nan(vr, margin):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        med = np.nanmedian( vr, axis=1 )[:, np.newaxis, :]
+        nd = np.abs(vr - med)
+        mnd = np.nanmedian( nd, axis=1 )[:, np.newaxis, :]
+    with np.errstate(invalid='ignore'):
+        out = nd > margin * mnd
+
+    return np.where( out, np.nan, vr )
+
+
+# returns start and stop row of each scan (separated by ScanGap seconds)
+def scan_limits(w):
+    t = w.index.get_level_values('time').values
+    newscan = np.where( np.diff(t) > np.timedelta64(cl.ScanGap, 's') )[0] + 1
+    starts = np.concatenate([ [0], newscan ])
+    stops = np.concatenate([ newscan, [len(t)] ])
+
+    return starts, stops
+
+
+# puts scans of long format data frame (rows from starts to stops) to 
+# arrays (scan, azimuth, gate) of columns in cols; each time stamp within a
+# scan is one azimuth, missing values are NaN; returns dictionary of arrays,
+# azimuth (scan, azimuth), elevation and start time (scan) and ranges
+def scan_arrays(w, starts, stops, cols):
+    t = w.index.get_level_values('time').values
+    r = w.index.get_level_values('range').values
+    ranges = np.unique(r)
+    nscan = len(starts)
+    scanno = np.repeat( np.arange(nscan), stops - starts )
+    # position of time stamp within its scan
+    tnew = np.concatenate([ [True], t[1:]<>t[:-1] ])
+    slot = np.cumsum(tnew) - 1
+    slot = slot - slot[starts][scanno]
+    gate = np.searchsorted(ranges, r)
+    shape = (nscan, slot.max() + 1, len(ranges))
+    arrs = {}
+    for col in cols:
+        arrs[col] = np.empty(shape)
+        arrs[col].fill(np.nan)
+        arrs[col][scanno, slot, gate] = w[col].values
+    az = np.empty(shape[0:2])
+    az.fill(np.nan)
+    az[scanno, slot] = w['azi'].values
 
-    return ws_out
+    return arrs, az, w['ele'].values[starts], t[starts], ranges
 
 
-# run loop over all VAD scans and fits sine function at all ranges
-def wind_fit(AllW, sProp, sDate):
-    if cl.SWITCH_POOL>0:
+# fits all scans of VAD scan data frame at once (vad_linear), returns data 
+# frame with start time of scan and range as index (start and stop row of 
+# scans from scan_limits if not given)
+def fit_linear(w, sProp, starts=None, stops=None):
+    col = cl.VarDict[sProp]['cols'][cl.VarDict[sProp]['N']]
+    if starts is None:
+        starts, stops = scan_limits(w)
+    arrs, az, ele, t0, ranges = scan_arrays(w, starts, stops, 
+            [col, 'confidence_index'])
+    vr = arrs[col]
+    if cl.SWITCH_OUTLIER:
+        vr = outliers_to_nan(vr, cl.OutlierMargin)
+    fit = vad_linear(vr, az, ele, cl.FitIter)
+
+    return fit_frame(fit, arrs['confidence_index'], t0, ranges)
+
+
+# fits each scan of VAD scan data frame with leastsq (fit_scan), in pool if 
+# given (see open_pool); results are written to one array (scan, gate, 
+# FitCols), returns data frame with start time of scan and range as index
+# (start and stop row of scans from scan_limits if not given)
+def fit_leastsq(w, sProp, pool=None, starts=None, stops=None):
+    col = cl.VarDict[sProp]['cols'][cl.VarDict[sProp]['N']]
+    if starts is None:
+        starts, stops = scan_limits(w)
+    arrs, az, ele, t0, ranges = scan_arrays(w, starts, stops, 
+            [col, 'confidence_index'])
+    vr = arrs[col]
+    if cl.SWITCH_OUTLIER:
+        vr = outliers_to_nan(vr, cl.OutlierMargin)
+    nscan = len(starts)
+    res = np.empty( (nscan, len(ranges), len(FitCols)) )
+    if pool is not None:
+        # radial wind and azimuth are shared with the pool via memory mapped 
+        # files, workers only get offsets of scans (few blocks per process)
+        shared = share_arrays([vr, az])
+        try:
+            bounds = np.linspace( 0, nscan, 
+                    min(nscan, 4 * cl.SWITCH_POOL) + 1 ).astype(int)
+            poolres = [ (s0, s1, pool.apply_async(loop_pool, 
+                args=(shared, s0, s1, ele[s0:s1]))) \
+                        for s0, s1 in zip(bounds[:-1], bounds[1:]) ]
+            for s0, s1, pr in poolres:
+                res[s0:s1] = pr.get()
+        finally:
+            [os.remove(f) for f in shared]
+    else:
+        for s in range(0, nscan):
+            fit_scan(vr[s], az[s], ele[s], res[s])
+    fit = dict( (c, res[..., i]) for i, c in enumerate(FitCols) )
+
+    return fit_frame(fit, arrs['confidence_index'], t0, ranges)
+
+
+# builds data frame of fit results (dictionary of arrays (scan, gate)) with 
+# start time of scan and range as index, adds mean confidence index 
+# (conf is array (scan, azimuth, gate))
+def fit_frame(fit, conf, t0, ranges):
+    windindex = pd.MultiIndex.from_product( [t0, ranges], names=['time', 'range'] )
+    wind = pd.DataFrame( dict( (c, fit[c].reshape(-1)) for c in FitCols ), 
+            index=windindex, columns=FitCols )
+    # filter out fits with rsquared smaller 0.5 using the confidence index
+    with np.errstate(invalid='ignore'):
+        meanconf = np.nanmean( conf, axis=1 )
+    wind['confidence_index'] = meanconf.reshape(-1)
+    wind.loc[wind['rsquared']<0.5, 'confidence_index'] = 0
+
+    return wind
+
+
+# run loop over all VAD scans and fits sine function at all ranges (six is 
+# the scan index of AllW, built if not given); scans fitted in earlier runs 
+# of the day are taken from the cache file (SWITCH_VADCACHE)
+def wind_fit(AllW, sProp, sDate, six=None):
+    if six is None:
+        six = scan_index(AllW)
+    if cl.SWITCH_VADCACHE:
+        cachefile = cl.ncInput + 'VAD_cache.pkl'
+        cache = wio.read_cache(cachefile)
+    else:
+        cache = None
+    # pool (leastsq fit only) stays open for the next call
+    if cl.SWITCH_FIT=='linear':
+        pool = None
+    else:
+        pool = open_pool()
+
+    combodf = pd.concat([ fit_parallel(AllW, sProp, sDate, VADscan, pool, six, 
+        cache) for VADscan in cl.ScanID['VAD'] ])
+
+    if cache is not None:
+        wio.write_cache(cachefile, cache)
+
+    combine_vad(combodf, sProp, sDate)
+
+
+# returns pool of processes for VAD fit (number of processes SWITCH_POOL), 
+# opens it at first call; None if not parallel (SWITCH_POOL 0)
+def open_pool():
+    global FitPool
+    if cl.SWITCH_POOL>0 and FitPool is None:
         # open number of pools specified in config file (SWITCH_POOL)
         wio.printif( '.... open pool ' )
-        pool = mp.Pool(processes=cl.SWITCH_POOL)
-    else:
-        pool = 'dummy'
+        FitPool = mp.Pool(processes=cl.SWITCH_POOL)
+
+    return FitPool
 
-    combodf = pd.concat([ fit_parallel(AllW, sProp, sDate, VADscan, pool) \
-            for VADscan in cl.ScanID['VAD'] ])
 
-    if cl.SWITCH_POOL>0:
+# closes pool of processes for VAD fit
+def close_pool():
+    global FitPool
+    if FitPool is not None:
         wio.printif( '.... close pool ' )
-        pool.close()
-        pool.join()
-    
+        FitPool.close()
+        FitPool.join()
+        FitPool = None
+
+
+# writes arrays to memory mapped .npy files (in shared memory /dev/shm if 
+# available) to pass them to pool processes without copying, returns file 
+# names
+def share_arrays(arrs):
+    if os.path.isdir('/dev/shm'):
+        shmdir = '/dev/shm'
+    else:
+        shmdir = None
+    shared = []
+    for arr in arrs:
+        fd, f = tempfile.mkstemp(suffix='.npy', prefix='windcube_', dir=shmdir)
+        os.close(fd)
+        mm = np.lib.format.open_memmap(f, mode='w+', dtype=arr.dtype, 
+                shape=arr.shape)
+        mm[:] = arr
+        mm.flush()
+        del mm
+        shared.append(f)
+
+    return shared
+
+
+# combines VAD scans at lower and upper angle, plots time series of result
+def combine_vad(combodf, sProp, sDate):
     # combine VAD scans at 15 and 75 degrees elevation
     combodf = combodf[
             ((combodf['ele']==cl.LowerAngle) 
@@ -122,7 +706,7 @@ def wind_fit(AllW, sProp, sDate):
     combodf.dropna( axis=0, how='all', subset=subs, inplace=True )
     combodf = combodf.reset_index()
     combodf['time'] = pd.to_datetime( combodf['time'], unit='s' )
-    combodf = combodf.set_index(['time','range']).unstack(level='range').resample('15T').stack(level='range')
+    combodf = grid_data( combodf.set_index(['time','range']), '15T' )
 
     # plot timeseries of combined VAD
     if cl.SWITCH_PLOT:
@@ -136,91 +720,142 @@ def wind_fit(AllW, sProp, sDate):
             wp.plot_ts(combodf, sProp, sDate, pv)
 
 
-def fit_parallel( AllW, sProp, sDate, VADscan, pool ):
-    w = AllW[AllW.scan_ID==VADscan]
+def fit_parallel( AllW, sProp, sDate, VADscan, pool, six, cache=None ):
+    w, starts, stops = scan_rows(AllW, six, VADscan)
     if len(w.scan_ID)>0:
         wio.printif('.... fitting VAD ' + str(VADscan) )
-        # separate different scans
-        t=[x[0] for x in w.index]
-        r=[x[1] for x in w.index]
-        newScanIx=np.where(np.diff(t)>dt.timedelta(seconds=59))
-        newScanIx = newScanIx[0]
-        newScanPlus=np.concatenate([[0],newScanIx[0:-1]])
-        # repeat fitting procedure for each VAD scan
-        onerange = w.index.get_level_values('range')[
-                w.index.get_level_values('time')==w.index.get_level_values('time')[0]]
-        windindex = pd.MultiIndex.from_product(
-                [w.index.get_level_values('time')[newScanPlus],onerange], \
-                        names=['time', 'range'])
-        clms = [ 'wspeed', 'w', 'wdir', 
-                'confidence_index', 'rsquared', 'number_of_function_calls' ]
-        win = pd.DataFrame(index=windindex, columns=clms, dtype='float64')
-        if cl.SWITCH_POOL>0:
-            # fit each VAD scan parallel in different pool
-            poolres = [
-                    pool.apply_async(loop_pool, \
-                            args=(w, ixs, newScanIx, newScanPlus, win, sProp) )\
-                            for ixs in range(0, len(newScanIx))
-                            ]
-            wind = pd.concat([res.get() for res in poolres])
-        elif cl.SWITCH_POOL==0:
-            # run loop if number of pools is 0 (not parallel)
-            windlist = [loop_pool(w, ixs, newScanIx, newScanPlus, win, sProp)\
-                    for ixs in range(0, len(newScanIx)) ]
-            wind = pd.concat(windlist)
+        if cache is not None:
+            # fit only scans not in cache
+            wind = fit_cached(w, sProp, pool, starts, stops, VADscan, cache)
         else:
-            wio.printif( '... Please check SWITCH_POOL in config file!' )
-
-        wind.set_index(windindex, inplace=True)
-        # change negative wind direction (adapt speed as well)
-        wind.loc[wind.wdir<0, 'wspeed'] = np.absolute( wind.loc[wind.wdir<0, 'wspeed'] )
-        wind.loc[wind.wdir<0, 'wdir'] = np.absolute( wind.loc[ wind.wdir<0, 'wdir' ] )
-        elestr = str( int( round( w['ele'][0] ) ) )
-        # change range to altitude above ground level
-        wind['alt'] = [x[1] * np.sin( np.radians( float(elestr) ) ) for x in wind.index]
-        clms = {'range': 'oldrange', 'alt': 'range'}
-        idx = ['time','range']
-        wind = wind.reset_index().rename(columns=clms).set_index(idx)
-
-        if cl.SWITCH_PLOT:
-            plotvars = [
-#                   ['rsquared', 'rsquared', elestr],
-#                   ['confidence_index', 'confidence_index', elestr],
-                    ['wspeed', 'horizontal wind speed / m/s', elestr],
-                    ['w', 'vertical wind speed / m/s (positive = updraft)', elestr],
-                    ['wdir', 'wind direction / degrees (0, 360 = North)', elestr],
-                    ]
-            for pv in plotvars:
-                wp.plot_ts(wind, sProp, sDate, pv)
-
-        if cl.SWITCH_OUTNC:
-            wio.export_to_netcdf(wind, sProp, sDate, '_VAD' + '_' + elestr)
-                
-        wind['ele'] = int( elestr )
-
-        return wind
-
-
-def loop_pool(w, ixs, newScanIx, newScanPlus, win, sProp):
-    s0 = newScanPlus[ixs]
-    s = newScanIx[ixs]
-    ws = w[s0:s+1]
-    meanconf = ws.confidence_index.mean(level=1)
-    elevation = np.radians( ws['ele'][0] )
+            wind = fit_scans(w, sProp, pool, starts, stops)
+
+        return vad_output(wind, w['ele'][0], sProp, sDate)
+
+
+# fits VAD scans of data frame w (start and stop row of scans) with fit 
+# selected by SWITCH_FIT
+def fit_scans(w, sProp, pool, starts, stops):
+    if cl.SWITCH_FIT=='linear':
+        # fit all scans at once
+        return fit_linear(w, sProp, starts, stops)
+    else:
+        # fit each scan and range gate
+        return fit_leastsq(w, sProp, pool, starts, stops)
+
+
+# fits only the scans of VAD scan data frame w (scan ID sID) missing in cache 
+# (dictionary of fitted scans by key of scan_keys) and adds them to it; 
+# cached scans of sID that are not in w any more are removed; returns data 
+# frame of fit results of all scans in w
+def fit_cached(w, sProp, pool, starts, stops, sID, cache):
+    keys = scan_keys(w, sProp, sID, starts, stops)
+    for k in [ k for k in cache if k[0]==sID and k not in keys ]:
+        del cache[k]
+    new = np.array([ i for i, k in enumerate(keys) if k not in cache ], 
+            dtype=int)
+    wio.printif( '..... fitting ' + str(len(new)) + ' of ' + str(len(keys)) \
+            + ' scans' )
+    if len(new)>0:
+        rows, newstarts, newstops = scan_positions( starts[new], stops[new] )
+        wind = fit_scans(w.iloc[rows], sProp, pool, newstarts, newstops)
+        # fit results are ordered by scan, same number of rows per scan
+        nr = len(wind) // len(new)
+        for j, i in enumerate(new):
+            cache[ keys[i] ] = wind.iloc[j*nr:(j+1)*nr]
+
+    return pd.concat([ cache[k] for k in keys ])
+
+
+# returns keys (scan ID, start time, checksum) of scans in VAD scan data frame
+# w (start and stop row of scans); the checksum covers the input of the fit 
+# and the fit settings (SWITCH_FIT, outlier removal, reweighted fits)
+def scan_keys(w, sProp, sID, starts, stops):
+    cols = [ cl.VarDict[sProp]['cols'][cl.VarDict[sProp]['N']], 
+            'azi', 'ele', 'confidence_index' ]
+    vals = np.ascontiguousarray( w[cols].values, dtype=np.float64 )
+    t = w.index.get_level_values('time').values
+    r = w.index.get_level_values('range').values.astype(np.float64)
+    settings = str( (cl.SWITCH_FIT, cl.SWITCH_OUTLIER, cl.OutlierMargin, 
+        cl.FitIter) )
+    keys = []
+    for s0, s1 in zip(starts, stops):
+        md5 = hashlib.md5( settings )
+        for arr in [ vals[s0:s1], t[s0:s1], r[s0:s1] ]:
+            md5.update( np.ascontiguousarray(arr).tostring() )
+        keys.append( (int(sID), str(t[s0]), md5.hexdigest()) )
+
+    return keys
+
+
+# changes wind direction and range of fitted VAD scans, plots and exports them
+def vad_output(wind, ele, sProp, sDate):
+    # change negative wind direction (adapt speed as well)
+    wind.loc[wind.wdir<0, 'wspeed'] = np.absolute( wind.loc[wind.wdir<0, 'wspeed'] )
+    wind.loc[wind.wdir<0, 'wdir'] = np.absolute( wind.loc[ wind.wdir<0, 'wdir' ] )
+    elestr = str( int( round( ele ) ) )
+    # change range to altitude above ground level
+    wind['alt'] = [x[1] * np.sin( np.radians( float(elestr) ) ) for x in wind.index]
+    clms = {'range': 'oldrange', 'alt': 'range'}
+    idx = ['time','range']
+    wind = wind.reset_index().rename(columns=clms).set_index(idx)
+
+    if cl.SWITCH_PLOT:
+        plotvars = [
+#               ['rsquared', 'rsquared', elestr],
+#               ['confidence_index', 'confidence_index', elestr],
+                ['wspeed', 'horizontal wind speed / m/s', elestr],
+                ['w', 'vertical wind speed / m/s (positive = updraft)', elestr],
+                ['wdir', 'wind direction / degrees (0, 360 = North)', elestr],
+                ]
+        for pv in plotvars:
+            wp.plot_ts(wind, sProp, sDate, pv)
+
+    # keep VAD result for comparison with DBS and HDCP2 output
+    wio.keep_product(sDate, 'VAD_' + elestr, wind.copy())
+    if cl.SWITCH_OUTNC:
+        wio.export_to_netcdf(wind, sProp, sDate, '_VAD' + '_' + elestr)
+            
+    wind['ele'] = int( elestr )
+
+    return wind
+
+
+# fits VAD scans s0 to s1 (elevation ele) in pool, radial wind and azimuth 
+# are read from memory mapped files shared (see share_arrays); returns 
+# result array (scan, gate, FitCols)
+def loop_pool(shared, s0, s1, ele):
+    vr, az = [ np.load(f, mmap_mode='r') for f in shared ]
+    res = np.empty( (s1 - s0, vr.shape[2], len(FitCols)) )
+    for s in range(s0, s1):
+        fit_scan(vr[s], az[s], ele[s - s0], res[s - s0])
+
+    return res
+
+
+# fits one VAD scan of the input stream, index is start time of scan and range
+def fit_stream_scan(ws, sProp):
+    if cl.SWITCH_FIT=='linear':
+        return fit_linear(ws, sProp)
+
+    return fit_leastsq(ws, sProp)
+
+
+# fits sine function at all ranges of one VAD scan, radial wind vr (azimuth, 
+# gate) at azimuth az and elevation ele; writes results (gate, FitCols) to 
+# res (new array if not given) and returns it
+def fit_scan(vr, az, ele, res=None):
+    if res is None:
+        res = np.empty( (vr.shape[1], len(FitCols)) )
     # run fit for each height bin
-    gr = ws.groupby(level='range')
-    fitlist=[]
-    gr.apply(lambda x: fitlist.append( run_fit(
-        x[cl.VarDict[sProp]['cols'][cl.VarDict[sProp]['N']]], 
-        x['azi'], x['ele'], sProp, 
-        x.index.get_level_values('range')[0])) )
-
-    wfit_out = pd.concat( fitlist )
-    # filter out fits with rsquared smaller 0.5 using the confidence index
-    wfit_out['confidence_index'] = meanconf
-    wfit_out.loc[wfit_out['rsquared']<0.5, 'confidence_index'] = 0
+    for g in range(0, vr.shape[1]):
+        valid = np.isfinite(vr[:, g]) & np.isfinite(az)
+        if valid.any():
+            run_fit(vr[valid, g], az[valid], ele, res[g])
+        else:
+            res[g] = [np.nan, np.nan, np.nan, -999, -999]
 
-    return wfit_out
+    return res
 
 
 # calculates time since "oldtime" and prints if output option is set to True